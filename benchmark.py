@@ -0,0 +1,300 @@
+'''Benchmark of the site pipeline in ``run.py`` on synthetic corpora.
+
+Each phase, i.e. collecting posts, category/archive/home pages and meta pages, is timed in
+isolation on a fresh copy of the corpus, so is the whole build, cold and incremental. Peak
+memory is measured with ``tracemalloc`` in a separate pass, since tracing slows down the
+code being timed. Results are appended to a JSON file with the git revision, so that they
+can be compared between revisions::
+
+    python benchmark.py                          # 1k and 10k posts
+    python benchmark.py --sizes 1000 10000 100000
+    python benchmark.py --compare 201192c        # compare with results of a revision
+'''
+
+import os
+import io
+import sys
+import json
+import time
+import random
+import shutil
+import platform
+import tracemalloc
+import subprocess
+from contextlib import redirect_stdout
+
+from run import Posts, Manifest, PageWriter, run
+
+
+WORK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'benchmark')
+RESULTS_FILENAME = 'results.json'
+
+CONFIG = '''site_name: Benchmark
+site_description: Synthetic corpus
+
+nav:
+'''
+
+# categories with popularity decreasing roughly by Zipf's law
+CATEGORIES = ['process automation', 'python/vba/cpp', 'mathematics', 'CAD/CAE integration',
+              'optimization', 'numeric calculation', 'finite element analysis', 'web development',
+              'devops', 'plasticity theory', 'machine learning', 'energy', 'feeling'] + \
+             [f'topic {i}' for i in range(1, 28)]
+TAGS = ['python', 'vba', 'c++', 'excel', 'pdf', 'mkdocs', 'linux', 'docker', 'numpy', 'scipy',
+        'abaqus', 'ansys', 'nx', 'git', 'latex', 'mathjax', 'ode', 'fem', 'lp', 'milp']
+
+# common Chinese characters and words to compose text
+HANZI = '的一是在不了有和人这中大为上个国我以要他时来用们生到作地于出就分对成会可主发年动同工也能' \
+        '下过子说产种面而方后多定行学法所民得经十三之进着等部度家电力里如水化高自二理起小物现实' \
+        '加量都两体制机当使点从业本去把性好应开它合还因由其些然前外天政四日那社义事平形相全表间' \
+        '样与关各重新线内数正心反你明看原又么利比或但质气第向道命此变条只没结解问意建月公无系军' \
+        '很情者最立代想已通并提直题党程展五果料象员革位入常文总次品式活设及管特件长求老头基资边' \
+        '流路级少图山统接知较将组见计别她手角期根论运农指几九区强放决西被干做必战先回则任取据处'
+WORDS = ['Python', 'Excel', 'VBA', 'PDF', 'Word', 'API', 'mkdocs', 'numpy', 'Markdown', 'Linux',
+         'solver', 'mesh', 'matrix', 'pipeline', 'cache', 'index']
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+
+class Corpus:
+    '''Synthetic posts ``yyyy-mm-dd-title.md`` with front matter, CJK/Latin mixed title and
+    body. Generation is deterministic for the same count and seed, so the corpus is generated
+    once and reused by later runs.
+    '''
+    def __init__(self, count:int, seed:int=0, body_size:int=3000) -> None:
+        '''
+        Args:
+            body_size (int): median size of post body in bytes; sizes are log-normal distributed.
+        '''
+        self.count = count
+        self.seed = seed
+        self.body_size = body_size
+        self.docs_dir = os.path.join(WORK_DIR, f'corpus-{count}-{seed}-{body_size}', 'docs')
+
+
+    def generate(self):
+        '''Generate posts unless they're already generated.'''
+        done_path = os.path.join(os.path.dirname(self.docs_dir), '.done')
+        if os.path.exists(done_path): return
+        if os.path.exists(self.docs_dir): shutil.rmtree(self.docs_dir)
+        os.makedirs(self.docs_dir)
+
+        rand = random.Random(self.seed)
+        sentences = [self._sentence(rand) for _ in range(500)]
+        weights = [1/(i+1) for i in range(len(CATEGORIES))]
+
+        # dates spread over 20 years; a few posts share one day
+        start = time.mktime((2005, 1, 1, 0, 0, 0, 0, 0, -1))
+        for i in range(self.count):
+            date = time.strftime('%Y-%m-%d', time.localtime(start + 20*365*86400*i/self.count))
+            title = self._title(rand, i)
+            filename = f'{date}-{title.replace(" ", "-")}.md'
+            with open(os.path.join(self.docs_dir, filename), 'w', encoding='utf-8') as f:
+                f.write(self._post(rand, title, sentences, weights))
+        open(done_path, 'w').close()
+
+
+    def copy_to(self, build_dir:str) -> str:
+        '''Copy corpus to a build directory with a config file. Return the config file path.'''
+        if os.path.exists(build_dir): shutil.rmtree(build_dir)
+        shutil.copytree(self.docs_dir, os.path.join(build_dir, 'docs'))
+        cfg_path = os.path.join(build_dir, '_mkdocs.yml')
+        with open(cfg_path, 'w', encoding='utf-8') as f: f.write(CONFIG)
+        return cfg_path
+
+
+    def _sentence(self, rand:random.Random):
+        words = []
+        for _ in range(rand.randint(3, 8)):
+            if rand.random()<0.15:
+                words.append(f' {rand.choice(WORDS)} ')
+            else:
+                words.append(''.join(rand.choices(HANZI, k=rand.randint(2, 6))))
+        return ''.join(words) + rand.choice('，。；：')
+
+
+    def _title(self, rand:random.Random, i:int):
+        prefix = f'{rand.choice(WORDS)} ' if rand.random()<0.4 else ''
+        return f'{prefix}{"".join(rand.choices(HANZI, k=rand.randint(4, 12)))}{i}'
+
+
+    def _post(self, rand:random.Random, title:str, sentences:list, weights:list):
+        lines = []
+
+        # front matter: no categories for a few posts
+        n = rand.choices([0, 1, 2, 3], weights=[1, 12, 5, 2])[0]
+        categories = sorted(set(rand.choices(CATEGORIES, weights=weights, k=n)))
+        tags = sorted(set(rand.sample(TAGS, rand.randint(0, 4))))
+        if categories or tags:
+            lines.extend(['---', f'categories: [{", ".join(categories)}]',
+                          f'tags: [{", ".join(tags)}]', '---', ''])
+        lines.extend([f'# {title}', '', '', '---', ''])
+
+        # body: paragraphs, with headings, code blocks, formulas and images occasionally
+        size = int(rand.lognormvariate(0, 0.6) * self.body_size)
+        written = 0
+        while written<size:
+            r = rand.random()
+            if r<0.1:
+                block = f'## {rand.choice(sentences)[:-1]}'
+            elif r<0.15:
+                block = f'```python\ndef f{written}(x):\n    return x**2 + {written}\n```'
+            elif r<0.2:
+                block = f'$$\n\\int_0^{{{written}}} x^2 \\mathrm{{d}}x\n$$'
+            elif r<0.23:
+                block = f'![figure](images/{rand.randint(1, 100)}.png)'
+            else:
+                block = ''.join(rand.choices(sentences, k=rand.randint(2, 6)))
+            lines.extend([block, ''])
+            written += len(block.encode('utf-8'))
+        return '\n'.join(lines)
+
+
+
+class Benchmark:
+    '''Time each phase of the pipeline on a copy of the corpus.'''
+
+    PHASES = ['collect', 'collect_cached', 'category_pages', 'archive_pages', 'home_page',
+              'meta_pages', 'build', 'build_cached']
+
+    def __init__(self, corpus:Corpus, workers:int=0) -> None:
+        self.corpus = corpus
+        self.workers = workers
+        self.build_dir = os.path.join(WORK_DIR, f'build-{corpus.count}')
+
+
+    def run(self, repeat:int=1, memory:bool=True) -> dict:
+        '''Time of each phase, the best of ``repeat`` runs, and peak memory if required.'''
+        results = {phase: {'seconds': float('inf')} for phase in Benchmark.PHASES}
+        for _ in range(repeat):
+            for phase, seconds in self._measure(tracing=False):
+                results[phase]['seconds'] = min(results[phase]['seconds'], seconds)
+
+        if memory:
+            tracemalloc.start()
+            try:
+                for phase, peak in self._measure(tracing=True):
+                    results[phase]['peak_mb'] = peak / (1<<20)
+            finally:
+                tracemalloc.stop()
+
+        return results
+
+
+    def _measure(self, tracing:bool):
+        '''Yield (phase, seconds), or (phase, peak bytes of traced memory) if ``tracing``. 
+        Setup of each phase, e.g. copying corpus, is excluded.
+        '''
+        cfg_path = self.corpus.copy_to(self.build_dir)
+        docs_dir = os.path.join(self.build_dir, 'docs')
+        posts_args = ('categories', 'archives')
+
+        def phase(name, fn):
+            if tracing:
+                tracemalloc.reset_peak()
+                result = fn()
+                return name, tracemalloc.get_traced_memory()[1], result
+            start = time.perf_counter()
+            result = fn()
+            return name, time.perf_counter()-start, result
+
+        # collecting posts: full parse, then restored from manifest
+        manifest = Manifest()
+        name, value, posts = phase('collect', lambda: Posts(docs_dir, *posts_args, manifest, self.workers))
+        yield name, value
+        name, value, _ = phase('collect_cached', lambda: Posts(docs_dir, *posts_args, manifest, self.workers))
+        yield name, value
+        del posts
+
+        # summary pages on a fresh catalog
+        posts = Posts(docs_dir, *posts_args, Manifest(), self.workers, writer=PageWriter())
+        for d in posts_args: os.makedirs(os.path.join(docs_dir, d), exist_ok=True)
+        yield phase('category_pages', posts.to_category_pages)[:2]
+        yield phase('archive_pages', posts.to_archive_pages)[:2]
+        yield phase('home_page', lambda: posts.to_home_page('# Benchmark\n\n', 10))[:2]
+        yield phase('meta_pages', posts.to_meta_pages)[:2]
+        del posts
+
+        # end to end: cold build, then nothing changed
+        cfg_path = self.corpus.copy_to(self.build_dir)
+        build = lambda: run(cfg_path, *reversed(posts_args), 10, True, self.workers)
+        with redirect_stdout(io.StringIO()):
+            yield phase('build', build)[:2]
+            yield phase('build_cached', build)[:2]
+
+
+
+def load_results(file_path:str) -> list:
+    if not os.path.isfile(file_path): return []
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_results(file_path:str, results:list):
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+
+
+def report(entry:dict, baseline:dict=None):
+    '''Print results of each corpus size, with ratio to baseline if provided.'''
+    for size, phases in entry['sizes'].items():
+        print(f'\n{size} posts')
+        print(f'{"phase":<16}{"seconds":>10}{"peak MB":>10}' + (f'{"vs " + baseline["revision"]:>14}' if baseline else ''))
+        base = (baseline or {}).get('sizes', {}).get(size, {})
+        for phase, result in phases.items():
+            peak = f'{result["peak_mb"]:.1f}' if 'peak_mb' in result else '-'
+            line = f'{phase:<16}{result["seconds"]:>10.3f}{peak:>10}'
+            if phase in base and base[phase]['seconds']>0:
+                line += f'{result["seconds"]/base[phase]["seconds"]:>13.2f}x'
+            print(line)
+
+
+
+if __name__=='__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark run.py on synthetic corpora.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000], help='counts of posts')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of corpus')
+    parser.add_argument('--body-size', type=int, default=3000, help='median bytes of post body')
+    parser.add_argument('--repeat', type=int, default=1, help='take the best of repeated runs')
+    parser.add_argument('--workers', type=int, default=0, help='count of workers parsing posts')
+    parser.add_argument('--no-memory', action='store_true', help='skip the pass measuring peak memory')
+    parser.add_argument('--results', default=os.path.join(WORK_DIR, RESULTS_FILENAME), help='file of stored results')
+    parser.add_argument('--compare', help='revision to compare with, the previous results by default')
+    args = parser.parse_args()
+
+    entry = {
+        'revision': git_revision(),
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'workers': args.workers,
+        'sizes': {}
+    }
+    for count in args.sizes:
+        corpus = Corpus(count, args.seed, args.body_size)
+        print(f'Generating corpus of {count} posts...', file=sys.stderr)
+        corpus.generate()
+        print(f'Benchmarking {count} posts...', file=sys.stderr)
+        entry['sizes'][str(count)] = Benchmark(corpus, args.workers).run(args.repeat, not args.no_memory)
+
+    # compare with stored results, then store current ones
+    history = load_results(args.results)
+    if args.compare:
+        baseline = next((e for e in reversed(history) if e['revision'].startswith(args.compare)), None)
+        if baseline is None: print(f'No results of revision {args.compare}.', file=sys.stderr)
+    else:
+        baseline = history[-1] if history else None
+    report(entry, baseline)
+
+    history.append(entry)
+    save_results(args.results, history)
@@ -0,0 +1,78 @@
+/**
+ * Client of the offline search index generated by `run.py --search`.
+ *
+ * Only `meta.json`, the term shards of query terms and the doc shards of top hits
+ * are fetched, and cached for later queries.
+ *
+ *     const search = new PostSearch('/search-index/');
+ *     search.query('遗传算法 python').then(hits => console.log(hits));
+ *     // [{url, title, date, score}, ...], where url is relative to site root
+ *
+ * It's opt-in: add it to `extra_javascript` of `mkdocs.yml` with a search box of your own.
+ */
+class PostSearch {
+    constructor(baseUrl) {
+        this.baseUrl = baseUrl.endsWith('/') ? baseUrl : baseUrl + '/';
+        this.shards = new Map();
+        this.meta = null;
+    }
+
+    // same as SearchIndex.tokenize(): bigrams of CJK characters, words of Latin text
+    static tokenize(text) {
+        const terms = new Set();
+        const pattern = /[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+|[a-z0-9_]+/g;
+        for (const [token] of text.toLowerCase().matchAll(pattern)) {
+            const chars = Array.from(token);
+            if (/^[a-z0-9_]+$/.test(token)) {
+                if (chars.length > 1) terms.add(token);
+            } else if (chars.length == 1) {
+                terms.add(token);
+            } else {
+                for (let i = 0; i < chars.length - 1; i++) terms.add(chars[i] + chars[i + 1]);
+            }
+        }
+        return Array.from(terms);
+    }
+
+    // same as SearchIndex.fnv1a(): 32-bit FNV-1a hash over code points
+    static fnv1a(term) {
+        let h = 0x811c9dc5;
+        for (const c of term) h = Math.imul(h ^ c.codePointAt(0), 0x01000193) >>> 0;
+        return h;
+    }
+
+    async fetchShard(filename) {
+        if (!this.shards.has(filename)) {
+            this.shards.set(filename, fetch(this.baseUrl + filename)
+                .then(res => res.ok ? res.json() : {})
+                .catch(() => ({})));
+        }
+        return this.shards.get(filename);
+    }
+
+    async query(text, limit = 10) {
+        this.meta = this.meta || await this.fetchShard('meta.json');
+        const terms = PostSearch.tokenize(text);
+        if (!terms.length) return [];
+
+        // score documents: sum of term weights, documents matching more terms first
+        const scores = new Map();
+        await Promise.all(terms.map(async term => {
+            const shard = await this.fetchShard(`terms-${PostSearch.fnv1a(term) % this.meta.shards}.json`);
+            for (const [id, weight] of (shard[term] || [])) {
+                const [count, score] = scores.get(id) || [0, 0];
+                scores.set(id, [count + 1, score + weight]);
+            }
+        }));
+        const top = Array.from(scores.entries())
+            .sort((a, b) => (b[1][0] - a[1][0]) || (b[1][1] - a[1][1]))
+            .slice(0, limit);
+
+        // details of top documents
+        return Promise.all(top.map(async ([id, [, score]]) => {
+            const shard = await this.fetchShard(`docs-${Math.floor(id / this.meta.docs_per_shard)}.json`);
+            const [url, title, date] = shard[id] || ['', '', ''];
+            return {url, title, date, score};
+        }));
+    }
+}
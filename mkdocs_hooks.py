@@ -0,0 +1,125 @@
+'''Plugin mode of ``run.py`` as mkdocs hooks: summary pages and home page are created as
+virtual files, navigation is injected into config, and meta-data is included into posts when
+building, so neither ``docs`` nor the config file is written. Enable it in config, see
+``mkdocs.hooks.yml``::
+
+    hooks:
+      - mkdocs_hooks.py
+
+Posts are recorded in the build manifest next to the config file, so unchanged posts are
+not parsed again when ``mkdocs serve`` rebuilds. Options of ``run.py`` are set under
+``extra``, e.g.::
+
+    extra:
+      summary:
+        archives: archives
+        categories: categories
+        latest_count: 10
+        page_size: 50
+        nav_limit: 20
+        related: 5
+        feed: 20
+        sitemap: true
+
+The sitemap generated from posts replaces the one of the theme.
+'''
+
+import os
+import tempfile
+from mkdocs.structure.files import File
+
+from run import Posts, ConfigFile, Manifest, RelatedPosts, MANIFEST_FILENAME, CACHE_DIRNAME
+
+
+OPTIONS = {
+    'archives': 'archives',
+    'categories': 'categories',
+    'latest_count': 10,
+    'page_size': 0,
+    'nav_limit': 0,
+    'related': 0,
+    'feed': 0,
+    'sitemap': False
+}
+
+_command = None
+_posts = None
+_options = None
+_related = None
+_tmp_dir = None
+
+
+def on_startup(command, dirty, **kwargs):
+    global _command
+    _command = command
+
+
+def on_config(config, **kwargs):
+    '''Collect posts and inject navigation.'''
+    global _posts, _options, _related
+    _options = dict(OPTIONS, **(config['extra'].get('summary') or {}))
+    build_dir = os.path.dirname(os.path.abspath(config['config_file_path']))
+    _posts = Posts(config['docs_dir'], _options['categories'], _options['archives'],
+                   Manifest(os.path.join(build_dir, MANIFEST_FILENAME)),
+                   page_size=_options['page_size'], nav_limit=_options['nav_limit'])
+    _posts.manifest.save()
+    config['nav'] = _posts.to_nav()
+
+    # related posts are appended along with meta-data
+    _related = None
+    if _command=='build' and _options['related']>0:
+        _related = RelatedPosts(os.path.join(build_dir, CACHE_DIRNAME, 'related.json'), _options['related'])
+        _related.update(_posts.iter_posts())
+    
+    if _options['sitemap']: config['theme'].static_templates.discard(Posts.SITEMAP_FILENAME)
+    return config
+
+
+def on_files(files, config, **kwargs):
+    '''Replace pages generated by ``run.py`` previously with virtual ones.'''
+    for file in list(files):
+        if file.src_uri in _posts.manifest.pages: files.remove(file)
+
+    pages = [*_posts.render_category_pages(), *_posts.render_archive_pages()]
+    if not files.get_file_from_path(Posts.INDEX_FILENAME):
+        title = ConfigFile.to_site_info(config['site_name'], config['site_description'])
+        pages.append((Posts.INDEX_FILENAME, _posts.render_home_page(title, _options['latest_count'])))
+
+    # feed and sitemap need absolute urls
+    if config['site_url'] and _options['feed']>0:
+        chunks = _posts.render_feed(config['site_url'], config['site_name'], config['site_description'] or '', 
+                                    _options['feed'], config['use_directory_urls'], config['site_author'] or '')
+        pages.append((Posts.FEED_FILENAME, ''.join(chunks)))
+    if config['site_url'] and _options['sitemap']:
+        chunks = _posts.render_sitemap(config['site_url'], config['use_directory_urls'])
+        pages.append((Posts.SITEMAP_FILENAME, ''.join(chunks)))
+
+    # replace existing files, e.g. sitemap.xml of theme
+    for src_uri, text in pages:
+        file = files.get_file_from_path(src_uri)
+        if file: files.remove(file)
+        files.append(_generated_file(config, src_uri, text))
+    return files
+
+
+def on_page_markdown(markdown, page, config, files, **kwargs):
+    '''Include meta-data and related posts into posts when building.'''
+    if _command!='build': return markdown
+    post = _posts.get(page.file.src_uri)
+    if post is None or post.offset is None: return markdown
+    links = [_posts.get(name) for name in _related.get(page.file.src_uri)] if _related else None
+    return post.render_meta_page(_options['categories'], links)
+
+
+def _generated_file(config, src_uri:str, text:str) -> File:
+    # mkdocs>=1.6 supports in-memory files; otherwise write to temporary directory
+    if hasattr(File, 'generated'):
+        return File.generated(config, src_uri, content=text)
+
+    global _tmp_dir
+    _tmp_dir = _tmp_dir or tempfile.mkdtemp()
+    file_path = os.path.join(_tmp_dir, src_uri)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    return File(src_uri, _tmp_dir, config['site_dir'], config['use_directory_urls'])
@@ -1,8 +1,27 @@
 # -*-coding:utf-8 -*-
 
+import io
 import os
 import re
+import gzip
+import json
+import math
+import shutil
+import hashlib
+import time
+import heapq
+import bisect
+import select
+import struct
+import tempfile
+import unicodedata
+import importlib.util
+from itertools import islice
+from contextlib import contextmanager
 from collections import defaultdict
+from urllib.parse import quote, unquote
+from xml.sax.saxutils import XMLGenerator
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 
 def to_dir_name(name:str):
@@ -14,8 +33,13 @@ class Post:
     NAME_PATTERN = re.compile(r'(?P<YEAR>\d{4})-(?P<MONTH>\d{2})-(?P<DAY>\d{2})-(?P<TITLE>.*).md')
     
     HLINE = '---'
+    META_PREFIX = '发布于：'
+    RELATED_MARKER = '<!-- related posts -->'
 
-    def __init__(self, post_path:str) -> None:
+    __slots__ = ('post_path', 'year', 'month', 'day', 'title', 'meta', 'categories', 
+                'hash', 'source_hash', 'offset', 'rewritten')
+
+    def __init__(self, post_path:str, record:dict=None) -> None:
         ''' post structure:        
                 ---
                 categories: [foo, bar, ...]
@@ -27,24 +51,59 @@ class Post:
                 ---
                 
                 content
+
+        Only the header, i.e. meta, title and separator, is parsed, while the position of
+        content is recorded so that it can be streamed when it's really needed, i.e. 
+        ``to_meta_page()``. Post is restored from a manifest record directly if provided.
         '''
         # get year-month-day-title from filename
         self.post_path = post_path
+        if record:
+            self._process_record(record)
+            return
         self._process_filename()
+        self._process_file()
+        self.rewritten = False
 
-        # get meta-data from content
-        with open(post_path, 'r', encoding='utf-8') as f:
-            src = f.read().strip()
-        if not src:
-            self.meta, self.content = None, None
-        else:
-            self._process_content(src)
-        
-        # check categories
-        self.categories = self._process_categories() if self.meta else None
+
+    def to_record(self, stat:os.stat_result=None) -> dict:
+        '''Parsed fields stored in build manifest.'''
+        stat = stat or os.stat(self.post_path)
+        return {
+            'mtime': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'hash': self.hash,
+            'source_hash': self.source_hash,
+            'year': self.year,
+            'month': self.month,
+            'day': self.day,
+            'title': self.title,
+            'meta': self.meta,
+            'categories': self.categories,
+            'offset': self.offset,
+            'rewritten': self.rewritten
+        }
     
 
-    def to_meta_page(self, category_dir_name:str):
+    def to_meta_page(self, category_dir_name:str, writer:'PageWriter'=None, related:list=None):
+        '''Rewrite post file with meta-data included, and links to ``related`` posts appended.'''
+        # content is streamed into the post
+        writer = writer or PageWriter()
+        header = self._meta_header(category_dir_name)
+        self.hash = writer.write_stream(self.post_path, self._iter_meta_page(header, related))
+
+        # now the post refers to the rewritten file, while ``source_hash`` is kept to tell 
+        # whether the content is changed
+        self.offset = len(header.encode('utf-8')) + len('\n\n\n')
+        self.rewritten = True
+
+
+    def render_meta_page(self, category_dir_name:str, related:list=None) -> str:
+        '''Page text with meta-data included, while the post file is not changed.'''
+        return ''.join(self._iter_meta_page(self._meta_header(category_dir_name), related))
+
+
+    def _meta_header(self, category_dir_name:str) -> str:
         lines = []
 
         # meta area
@@ -57,21 +116,52 @@ class Post:
         lines.append('\n')
         lines.append(f'# {self.title}')
         lines.append('\n')
-        meta = f'发布于：{self.year}-{self.month}-{self.day}'
+        meta = f'{Post.META_PREFIX}{self.year}-{self.month}-{self.day}'
         if self.categories:
             links = [f'[{c}]({category_dir_name}/{to_dir_name(c)}.md)' for c in self.categories]
             meta += ' | 分类：' + ' , '.join(links)
         lines.append(meta)
         lines.append('\n')
         lines.append(Post.HLINE)
+        return '\n'.join(lines)
+
 
-        # content
-        if self.content:
-            lines.append('\n')
-            lines.extend(self.content)
+    def _iter_meta_page(self, header:str, related:list=None):
+        yield header
+        sep = '\n\n\n' # an empty line between header and content
+        for line in self.iter_content():
+            yield sep + line
+            sep = '\n'
         
-        with open(self.post_path, 'w', encoding='utf-8') as f:
-            f.write('\n'.join(lines))
+        # related posts, starting with a marker so that it's replaced in next build
+        if related:
+            yield f'\n\n{Post.RELATED_MARKER}\n## 相关文章\n\n'
+            yield '\n'.join(post.to_hyperlink('.') for post in related)
+
+
+    def iter_content(self):
+        '''Stream content lines from post file, with trailing blanks and the related posts 
+        appended by ``to_meta_page()`` removed.
+        '''
+        if self.offset is None: return
+        with open(self.post_path, 'rb') as f:
+            f.seek(self.offset)
+            last, blanks = None, []
+            for raw in f:
+                line = raw.decode('utf-8').rstrip('\r\n')
+                if line==Post.RELATED_MARKER: break
+                if not line.strip():
+                    blanks.append(line) # hold blank lines until next non-blank line
+                    continue
+                if last is not None: yield last
+                yield from blanks
+                last, blanks = line, []
+            if last is not None: yield last.rstrip()
+
+
+    def content_size(self) -> int:
+        '''Bytes of content read by ``iter_content()``.'''
+        return 0 if self.offset is None else os.path.getsize(self.post_path)-self.offset
 
 
     def to_hyperlink(self, rel_path:str='.'):
@@ -79,6 +169,28 @@ class Post:
         return f'- `{self.year}-{self.month}-{self.day}` [{self.title}]({rel_path}/{filename})'
 
 
+    def excerpt(self, length:int=200) -> str:
+        '''First paragraph of content, skipping headings, images, code, tables, formulas, etc.'''
+        words = []
+        for line in self.iter_content():
+            line = line.strip()
+            if not line:
+                if words: break
+                continue
+            if line[0] in '#!<|`$>[': 
+                if words: break
+                continue
+            words.append(line)
+        text = ' '.join(words)
+        return text if len(text)<=length else text[:length].rstrip() + '…'
+
+
+    def _process_record(self, record:dict):
+        for key in ('hash', 'source_hash', 'year', 'month', 'day', 'title', 'meta', 'categories', 
+                    'offset', 'rewritten'):
+            setattr(self, key, record.get(key))
+
+
     def _process_filename(self):
         filename = os.path.basename(self.post_path)
         res = Post.NAME_PATTERN.match(filename)
@@ -89,24 +201,67 @@ class Post:
         self.title = res.group('TITLE').replace('-', ' ') if matched else None
     
 
-    def _process_content(self, src:str):
-        lines = src.splitlines()
+    def _process_file(self):
+        '''Read lines until header is resolved; the rest is only hashed chunk by chunk.'''
+        self.meta, self.offset = None, None
+        sha = hashlib.sha1()
+        with open(self.post_path, 'rb') as f:
+            self._process_header(Post._iter_lines(f, sha))
+            for chunk in iter(lambda: f.read(1<<16), b''):
+                sha.update(chunk)
+        self.hash = self.source_hash = sha.hexdigest()
+        
+        # check categories
+        self.categories = self._process_categories() if self.meta else None
+
+
+    @staticmethod
+    def _iter_lines(f, sha):
+        '''Yield (start, end, text) of each line, skipping leading blank lines of the file.'''
+        start, leading = f.tell(), True
+        for raw in f:
+            sha.update(raw)
+            end = start + len(raw)
+            line = raw.decode('utf-8').rstrip('\r\n')
+            if not leading or line.strip():
+                yield start, end, line.lstrip() if leading else line
+                leading = False
+            start = end
+
+
+    @staticmethod
+    def _next_non_blank(lines):
+        return next((item for item in lines if item[2].strip()), None)
+
+
+    def _process_header(self, lines):
+        item = next(lines, None)
+        if item is None: return # empty post
+        
         # potential meta
         self.meta = []
-        next_i = 0
-        if lines[0].startswith(Post.HLINE): 
-            for i, line in enumerate(lines[1:], start=1) :
-                s = line.strip()
+        if item[2].startswith(Post.HLINE):
+            first = item
+            for item in lines:
+                s = item[2].strip()
                 if s == '': continue
                 if ':' in s: 
                     self.meta.append(s)
                 elif s.startswith(Post.HLINE): # normal end of meta
-                    next_i = i+1
                     break
                 else: # not valid meta
                     self.meta = None
-                    break        
-        self._extract_title_and_content(lines[next_i:])
+                    break
+            else:
+                item = None
+            
+            # content starts right after the first line if meta is not closed properly
+            if item is None or self.meta is None:
+                self.offset = first[1]
+                return
+            item = Post._next_non_blank(lines)
+        
+        self._extract_title_and_content(item, lines)
 
 
     def _process_categories(self):
@@ -116,34 +271,30 @@ class Post:
             return [c.strip() for c in text.split(',')]
 
 
-    def _extract_title_and_content(self, lines):
-        '''extract title starting with `# ` and content right after `---`.'''
-        next_i = 0
-        for i, line in enumerate(lines):
-            s = line.strip()
-            if s == '': 
-                continue
-            elif s.startswith('# '):
-                self.title = line[2:].strip() # overwrite title extracted from filename
-                next_i = i+1
-                break
-            else:
-                break        
+    def _extract_title_and_content(self, item, lines):
+        '''extract title starting with `# ` and content right after `---`. The meta line and 
+        separator inserted by ``to_meta_page()`` in previous build are skipped, so that they're 
+        replaced rather than stacked when the post is rewritten again.
+        '''
+        if item and item[2].strip().startswith('# '):
+            self.title = item[2].strip()[2:].strip() # overwrite title extracted from filename
+            item = Post._next_non_blank(lines)
 
-        self._extract_content(lines[next_i:])
+        # generated meta line followed by `---` and two blank lines, otherwise it's content
+        if item and item[2].startswith(Post.META_PREFIX):
+            sep = Post._next_non_blank(lines)
+            if sep and sep[2].strip().startswith(Post.HLINE):
+                self.offset = sep[1]
+                for _ in range(2):
+                    blank = next(lines, None)
+                    if blank is None or blank[2].strip(): break
+                    self.offset = blank[1]
+                return
 
-
-    def _extract_content(self, lines):
-        '''check start of content: right after `---`'''
-        start = None
-        for i, line in enumerate(lines):
-            s = line.strip()
-            if s == '': 
-                continue
-            else:
-                start = i+1 if s.startswith(Post.HLINE) else i
-                break
-        self.content = lines[start:] if start else None
+        # check start of content: right after `---`
+        if item is None: return
+        start, end, line = item
+        self.offset = end if line.strip().startswith(Post.HLINE) else start
 
 
 
@@ -152,60 +303,251 @@ class Posts:
     INDEX_FILENAME   = 'index.md'
     ARCHIVE_FILENAME = 'archive.md'
     ABOUT_FILENAME   = 'about.md'
+    CATEGORY_FILENAME = 'category.md'
+    FEED_FILENAME    = 'feed.xml'
+    SITEMAP_FILENAME = 'sitemap.xml'
+
+    def __init__(self, docs_dir:str, category_dir_name:str='categories', archive_dir_name:str='archives', 
+                manifest:'Manifest'=None, workers:int=0, use_process:bool=False, 
+                writer:'PageWriter'=None, page_size:int=0, nav_limit:int=0, 
+                report:'BuildReport'=None) -> None: 
+        '''Collect posts under ``docs_dir``.
 
-    def __init__(self, docs_dir:str, category_dir_name:str='categories', archive_dir_name:str='archives') -> None: 
+        Args:
+            manifest (Manifest): restore unchanged posts from manifest rather than parsing them.
+            workers (int): parse changed posts with a pool of ``workers`` in parallel. Serial if 0.
+            use_process (bool): parse with process pool if True, otherwise thread pool.
+            writer (PageWriter): write generated pages only if changed.
+            page_size (int): split summary pages into pages of ``page_size`` posts. No split if 0.
+            nav_limit (int): list only the largest ``nav_limit`` categories in navigation and 
+                home page, with a link to the page of all categories. No limit if 0.
+            report (BuildReport): record files read and time of parsing each post if provided.
+        '''
         self.docs_dir = docs_dir
         self.category_dir_name = category_dir_name
         self.archive_dir_name = archive_dir_name
+        self.page_size = page_size
+        self.nav_limit = nav_limit
+        self.manifest = manifest or Manifest()
+        self.writer = writer or PageWriter()
+        self.report = report
 
-        self._posts = defaultdict(list) # summarized by year/category
-        self._archives = set()
-        self._categories = set()
+        # posts are referred by integer id, i.e. index in ``self._items``, and the
+        # indexes hold ids in ascending order of file name, i.e. date
+        self._items = []     # id -> post, None if removed
+        self._names = []     # id -> file name, the sort key
+        self._ids = {}       # file name -> id
+        self._years = {}     # yyyy -> ids
+        self._months = {}    # yyyy-mm -> ids
+        self._categories = {} # category -> ids
+        
+        # stat results of scandir are reused to check the manifest
+        with os.scandir(docs_dir) as it:
+            entries = sorted((entry for entry in it if entry.is_file()), key=lambda entry: entry.name)
         
-        for filename in sorted(os.listdir(docs_dir), reverse=True):            
-            post_path = os.path.join(docs_dir, filename)
-            if not os.path.isfile(post_path): continue
-            post = Post(post_path)
+        # restore unchanged posts from manifest; None for posts to parse
+        posts, stats = [], []
+        for entry in entries:
+            stat = entry.stat()
+            record = self.manifest.posts.get(entry.name)
+            unchanged = record and record['mtime']==stat.st_mtime_ns and record['size']==stat.st_size
+            posts.append(Post(entry.path, record) if unchanged else None)
+            stats.append(stat)
+        
+        # parse changed posts, in parallel if required
+        paths = [entry.path for entry, post in zip(entries, posts) if post is None]
+        parse = Posts._parse_timed if report else Post
+        if workers>0 and len(paths)>1:
+            Executor = ProcessPoolExecutor if use_process else ThreadPoolExecutor
+            with Executor(max_workers=workers) as executor:
+                parsed = iter(executor.map(parse, paths, chunksize=max(1, len(paths)//(workers*4))))
+        else:
+            parsed = map(parse, paths)
+
+        # merge in the order of file names, no matter parsed in serial or parallel; only 
+        # records of changed posts are updated
+        for entry, stat, post in zip(entries, stats, posts):
+            if post is None:
+                post = next(parsed)
+                if report:
+                    post, seconds = post
+                    report.read(stat.st_size)
+                    report.time_post(entry.name, seconds)
+                self.manifest.posts[entry.name] = post.to_record(stat)
             self.append(post)
+        
+        # drop records of removed posts
+        names = {entry.name for entry in entries}
+        for name in [name for name in self.manifest.posts if name not in names]:
+            del self.manifest.posts[name]
 
 
     def append(self, post:Post):
         if not isinstance(post, Post) or post.year is None: return
-        # by year
-        self._posts[post.year].append(post)
-        self._archives.add(post.year)
+        filename = os.path.basename(post.post_path)
+        if filename in self._ids: self.remove(self._items[self._ids[filename]])
 
-        # by category
-        for c in (post.categories or ['未分类']):
-            self._posts[c].append(post)
-            self._categories.add(c)
+        i = len(self._items)
+        self._items.append(post)
+        self._names.append(filename)
+        self._ids[filename] = i
 
+        for index, key in self._index_keys(post):
+            self._insert(index.setdefault(key, []), i)
+    
+
+    def remove(self, post:Post):
+        i = self._ids.pop(os.path.basename(post.post_path), None)
+        if i is None: return
+        for index, key in self._index_keys(post):
+            ids = index[key]
+            del ids[self._locate(ids, i)]
+            if not ids: del index[key]
+        self._items[i] = None
+
+
+    def get(self, filename:str) -> Post:
+        '''Post by file name, None if not exists.'''
+        i = self._ids.get(filename)
+        return None if i is None else self._items[i]
+
+
+    def count(self, key:str) -> int:
+        '''Count of posts in a category or year.'''
+        return len(self._categories.get(key) or self._years.get(key) or ())
+    
 
-    def to_category_pages(self):
-        '''Create summary pages grouped by category.'''
+    def iter_posts(self, year:str=None, month:str=None, category:str=None):
+        '''Iterate posts from newest to oldest, in a year, month (mm) of year, or category.'''
+        if category is not None:
+            ids = self._categories.get(category, ())
+        elif month is not None:
+            ids = self._months.get(f'{year}-{month}', ())
+        elif year is not None:
+            ids = self._years.get(year, ())
+        else:
+            ids = sorted(self._ids.values(), key=self._names.__getitem__)
+        return (self._items[i] for i in reversed(ids))
+
+
+    def refresh(self, filenames) -> tuple:
+        '''Apply changes of created, modified or deleted files to the year/category index.
+
+        Returns:
+            tuple: affected years and categories.
+        '''
+        years, categories = set(), set()
+        for filename in filenames:
+            old = self._items[self._ids[filename]] if filename in self._ids else None
+            if old:
+                self.remove(old)
+                years.add(old.year)
+                categories.update(old.categories or ['未分类'])
+            
+            post_path = os.path.join(self.docs_dir, filename)
+            if not os.path.isfile(post_path):
+                self.manifest.posts.pop(filename, None)
+                continue
+            # removed or being saved by editor meanwhile: skip it until next change
+            try:
+                post = Post(post_path)
+                self.manifest.posts[filename] = post.to_record()
+            except (OSError, UnicodeDecodeError) as e:
+                self.manifest.posts.pop(filename, None)
+                print(f'{filename} is skipped: {e}')
+                continue
+            if post.year is None: continue
+            self.append(post)
+            years.add(post.year)
+            categories.update(post.categories or ['未分类'])
+
+        return years, categories
+
+
+    def to_category_pages(self, categories:set=None):
+        '''Create summary pages grouped by category; only the given categories if specified.'''
         page_dir = os.path.join(self.docs_dir, self.category_dir_name)
-        for c in self._categories:
-            self._to_summary_page(c, page_dir)
+        os.makedirs(page_dir, exist_ok=True)
+        for rel_path, text in self.render_category_pages(categories):
+            self._write_page(os.path.join(self.docs_dir, rel_path), text)
+        self._remove_stale_pages(page_dir, self._categories)
+
+        # page of all categories is not needed any more
+        page_path = os.path.join(self.docs_dir, Posts.CATEGORY_FILENAME)
+        if not self._is_nav_limited() and self.manifest.pages.pop(Posts.CATEGORY_FILENAME, None) \
+            and os.path.isfile(page_path):
+            os.remove(page_path)
  
 
-    def to_archive_pages(self):
-        '''Create summary pages grouped by year.'''
-        lines = ['## Archives\n']
+    def to_archive_pages(self, years:set=None):
+        '''Create summary pages grouped by year; only the given years if specified.'''
         page_dir = os.path.join(self.docs_dir, self.archive_dir_name)
-        for year in sorted(self._archives, reverse=True):
-            len_posts = len(self._posts.get(year))
+        os.makedirs(page_dir, exist_ok=True)
+        for rel_path, text in self.render_archive_pages(years):
+            self._write_page(os.path.join(self.docs_dir, rel_path), text)
+        self._remove_stale_pages(page_dir, self._years)
+
+
+    def to_home_page(self, title:str='', count:int=5):
+        '''Create home page with latest posts and categories.'''
+        text = self.render_home_page(title, count)
+        self._write_page(os.path.join(self.docs_dir, Posts.INDEX_FILENAME), text)
+
+
+    def to_feed(self, site_url:str, title:str, description:str='', count:int=20, 
+                use_directory_urls:bool=True, author:str=''):
+        '''Create Atom feed of the latest posts. It's regenerated only if the site info or 
+        any of the latest posts changes.
+        '''
+        posts = self._get_latest(count)
+        inputs = [site_url, title, description, str(use_directory_urls), author]
+        inputs.extend(f'{os.path.basename(post.post_path)}:{post.hash}' for post in posts)
+        self._write_xml(Posts.FEED_FILENAME, inputs, 
+                        self.render_feed(site_url, title, description, count, use_directory_urls, author))
+
+
+    def to_sitemap(self, site_url:str, use_directory_urls:bool=True):
+        '''Create sitemap of home page, summary pages and posts. It's regenerated only if any 
+        page is added, removed or dated differently.
+        '''
+        inputs = (f'{loc} {lastmod}' for loc, lastmod in self._iter_sitemap_urls(site_url, use_directory_urls))
+        self._write_xml(Posts.SITEMAP_FILENAME, inputs, self.render_sitemap(site_url, use_directory_urls))
+
+
+    def render_category_pages(self, categories:set=None):
+        '''Yield (path relative to docs, text) of summary pages grouped by category, and the 
+        page of all categories if navigation is limited.
+        '''
+        for c in (self._categories if categories is None else categories):
+            yield from self._render_summary_pages(c, self._categories.get(c), self.category_dir_name)
+
+        # all categories on a standalone page, once they're too many to be listed elsewhere
+        if self._is_nav_limited():
+            lines = ['## Categories\n']
+            for c in sorted(self._categories):
+                len_posts = len(self._categories[c])
+                lines.append(f'- [{c} ({len_posts})]({self.category_dir_name}/{to_dir_name(c)}.md)')
+            yield Posts.CATEGORY_FILENAME, '\n'.join(lines)
+
+
+    def render_archive_pages(self, years:set=None):
+        '''Yield (path relative to docs, text) of summary pages grouped by year, and the top 
+        archive page.
+        '''
+        lines = ['## Archives\n']
+        for year in sorted(self._years, reverse=True):
+            len_posts = len(self._years[year])
             lines.append(f'- [{year} ({len_posts})]({self.archive_dir_name}/{year}.md)')
 
             # pages in each year
-            self._to_summary_page(year, page_dir)
+            if years is None or year in years:
+                yield from self._render_summary_pages(year, self._years[year], self.archive_dir_name)
         
         # top page
-        with open(os.path.join(self.docs_dir, Posts.ARCHIVE_FILENAME), 'w', encoding='utf-8') as f:
-            f.write('\n'.join(lines))            
+        yield Posts.ARCHIVE_FILENAME, '\n'.join(lines)
 
 
-    def to_home_page(self, title:str='', count:int=5):
-        '''Create home page with latest posts and categories.'''
+    def render_home_page(self, title:str='', count:int=5) -> str:
         lines = [title]
 
         # latest posts
@@ -216,12 +558,80 @@ class Posts:
         # categories
         lines.append('\n')
         lines.append('## 更多分类\n')
-        for c in sorted(self._categories):
-            len_posts = len(self._posts.get(c))
+        for c in self._nav_categories():
+            len_posts = len(self._categories[c])
             lines.append(f'- [{c} ({len_posts})]({self.category_dir_name}/{to_dir_name(c)}.md)')
+        if self._is_nav_limited():
+            lines.append(f'- [全部分类 ({len(self._categories)})]({Posts.CATEGORY_FILENAME})')
 
-        with open(os.path.join(self.docs_dir, Posts.INDEX_FILENAME), 'w', encoding='utf-8') as f:
-            f.write('\n'.join(lines))
+        return '\n'.join(lines)
+
+
+    def render_feed(self, site_url:str, title:str, description:str='', count:int=20, 
+                    use_directory_urls:bool=True, author:str=''):
+        '''Yield text chunks of Atom feed of the latest ``count`` posts. The feed ``author``, 
+        required by Atom since entries have none, is the site title if not specified.
+        '''
+        posts = self._get_latest(count)
+        updated = f'{posts[0].year}-{posts[0].month}-{posts[0].day}T00:00:00Z' if posts else '1970-01-01T00:00:00Z'
+        xml, buffer = Posts._xml_writer()
+        xml.startElement('feed', {'xmlns': 'http://www.w3.org/2005/Atom'})
+        Posts._xml_element(xml, 'title', title)
+        if description: Posts._xml_element(xml, 'subtitle', description)
+        Posts._xml_element(xml, 'link', attrs={'href': site_url})
+        Posts._xml_element(xml, 'link', attrs={'rel': 'self', 'href': self._to_url(site_url, Posts.FEED_FILENAME)})
+        Posts._xml_element(xml, 'id', site_url)
+        Posts._xml_element(xml, 'updated', updated)
+        xml.startElement('author', {})
+        Posts._xml_element(xml, 'name', author or title)
+        xml.endElement('author')
+        xml.ignorableWhitespace('\n')
+        yield Posts._xml_flush(buffer)
+
+        # one entry per post
+        for post in posts:
+            url = self._to_url(site_url, os.path.basename(post.post_path), use_directory_urls)
+            xml.startElement('entry', {})
+            Posts._xml_element(xml, 'title', post.title)
+            Posts._xml_element(xml, 'link', attrs={'href': url})
+            Posts._xml_element(xml, 'id', url)
+            Posts._xml_element(xml, 'updated', f'{post.year}-{post.month}-{post.day}T00:00:00Z')
+            for c in (post.categories or ()):
+                Posts._xml_element(xml, 'category', attrs={'term': c})
+            summary = post.excerpt()
+            if summary: Posts._xml_element(xml, 'summary', summary)
+            xml.endElement('entry')
+            xml.ignorableWhitespace('\n')
+            yield Posts._xml_flush(buffer)
+        
+        xml.endElement('feed')
+        xml.endDocument()
+        yield Posts._xml_flush(buffer)
+
+
+    def render_sitemap(self, site_url:str, use_directory_urls:bool=True):
+        '''Yield text chunks of sitemap, a chunk per page, so it's never held in memory.'''
+        xml, buffer = Posts._xml_writer()
+        xml.startElement('urlset', {'xmlns': 'http://www.sitemaps.org/schemas/sitemap/0.9'})
+        xml.ignorableWhitespace('\n')
+        for loc, lastmod in self._iter_sitemap_urls(site_url, use_directory_urls):
+            xml.startElement('url', {})
+            Posts._xml_element(xml, 'loc', loc)
+            if lastmod: Posts._xml_element(xml, 'lastmod', lastmod)
+            xml.endElement('url')
+            xml.ignorableWhitespace('\n')
+            yield Posts._xml_flush(buffer)
+        xml.endElement('urlset')
+        xml.endDocument()
+        yield Posts._xml_flush(buffer)
+
+
+    def is_generated_page(self, page_path:str) -> bool:
+        '''Whether the page was created by this script and not modified since then.'''
+        key = os.path.relpath(page_path, self.docs_dir)
+        if key not in self.manifest.pages or not os.path.isfile(page_path): return False
+        with open(page_path, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()==self.manifest.pages[key]
 
 
     def to_navigation(self) -> str:
@@ -232,117 +642,1892 @@ class Posts:
                 - '分类':
                     - 'foo': categories/foo.md
                     - 'bar': categories/bar.md
+                    - '全部分类': category.md  # only if navigation is limited
                 - '归档': archives.md
                 - '关于': about.md
                 ...
         '''
         nav = ['nav:']
-        nav.append("  - '分类':")
-        for c in sorted(self._categories):
-            nav.append(f'    - {c}: {self.category_dir_name}/{to_dir_name(c)}.md')
-        
-        # archive, about
-        nav.extend([
-            f'  - 归档: {Posts.ARCHIVE_FILENAME}',
-            f'  - 关于: {Posts.ABOUT_FILENAME}'
-        ])
-        
+        for item in self.to_nav():
+            (title, value), = item.items()
+            if isinstance(value, list):
+                nav.append(f"  - '{title}':")
+                nav.extend(f'    - {k}: {v}' for child in value for k, v in child.items())
+            else:
+                nav.append(f'  - {title}: {value}')
         return '\n'.join(nav)
 
+
+    def to_nav(self) -> list:
+        '''Grouped navigation in the structure of mkdocs config ``nav``.'''
+        categories = [{c: f'{self.category_dir_name}/{to_dir_name(c)}.md'} for c in self._nav_categories()]
+        if self._is_nav_limited():
+            categories.append({'全部分类': Posts.CATEGORY_FILENAME})
+
+        # archive, about
+        return [
+            {'分类': categories},
+            {'归档': Posts.ARCHIVE_FILENAME},
+            {'关于': Posts.ABOUT_FILENAME}
+        ]
+
  
-    def to_meta_pages(self):
-        '''Update page content with meta-date included.'''
-        for year in self._archives:
-            for post in self._posts.get(year, []):
-                post.to_meta_page(self.category_dir_name)
+    def to_meta_pages(self, related:'RelatedPosts'=None):
+        '''Update page content with meta-date included, and related posts appended if provided. 
+        Posts already rewritten in previous build and not changed since then, e.g. synchronized 
+        build directory, are skipped unless their related posts changed.
+        '''
+        for post in self._items:
+            if post is None: continue
+            filename = os.path.basename(post.post_path)
+            if post.rewritten and not (related and filename in related.changed): continue
+            if self.report:
+                self.report.read(self.manifest.posts[filename]['size']-post.offset)
+                start = time.perf_counter()
+            links = [self.get(name) for name in related.get(filename)] if related else None
+            post.to_meta_page(self.category_dir_name, self.writer, links)
+            if self.report:
+                self.report.time_post(filename, time.perf_counter()-start)
+            self.manifest.posts[filename] = post.to_record()
 
 
     def _get_latest(self, count:int):
-        posts = []
-        need = count
-        for year in sorted(self._archives, reverse=True):
-            year_posts = self._posts.get(year)
-            year_cnt = len(year_posts)
-            if year_cnt>=need:
-                posts.extend(year_posts[0:need])
-                break
+        '''Top-k newest posts: merge the tails of year indexes lazily with a heap, so only 
+        ``count`` ids are visited, no matter how many posts there are.
+        '''
+        tails = (reversed(ids) for ids in self._years.values())
+        latest = heapq.merge(*tails, key=self._names.__getitem__, reverse=True)
+        return [self._items[i] for i in islice(latest, count)]
+
+
+    @staticmethod
+    def _parse_timed(post_path:str) -> tuple:
+        '''Parse post and return it with seconds taken; a static method, so that it can be 
+        sent to process pool.
+        '''
+        start = time.perf_counter()
+        post = Post(post_path)
+        return post, time.perf_counter()-start
+
+
+    def _is_nav_limited(self) -> bool:
+        return 0<self.nav_limit<len(self._categories)
+
+
+    def _nav_categories(self) -> list:
+        '''Categories listed in navigation: the largest ``nav_limit`` ones if limited, in 
+        order of name anyway.
+        '''
+        if not self._is_nav_limited(): return sorted(self._categories)
+        largest = heapq.nlargest(self.nav_limit, sorted(self._categories), 
+                                 key=lambda c: len(self._categories[c]))
+        return sorted(largest)
+
+
+    def _index_keys(self, post:Post):
+        '''Pairs of (index, key) where the post is indexed.'''
+        yield self._years, post.year
+        yield self._months, f'{post.year}-{post.month}'
+        for c in (post.categories or ['未分类']):
+            yield self._categories, c
+
+
+    def _insert(self, ids:list, i:int):
+        '''Insert id in ascending order of file name; appended directly in most cases.'''
+        if not ids or self._names[ids[-1]]<self._names[i]:
+            ids.append(i)
+        else:
+            bisect.insort(ids, i, key=self._names.__getitem__)
+
+
+    def _locate(self, ids:list, i:int) -> int:
+        return bisect.bisect_left(ids, self._names[i], key=self._names.__getitem__)
+
+
+    def _render_summary_pages(self, name:str, ids:list, dir_name:str):
+        '''Summary page dir_name/name.md, or split into pages of ``page_size`` posts with links
+        to newer/older page. Pages are anchored at the oldest post, i.e. name-1.md, name-2.md,
+        ... are full pages from the oldest, while name.md holds the newest posts. So appending 
+        a post changes name.md only, or the two newest pages when a new page is started.
+        '''
+        if not ids: return # removed category/year
+        pages = self._page_slices(name, len(ids))
+        for k, (filename, start, end) in enumerate(pages):
+            lines = [f'## {name}\n\n']
+            for i in reversed(ids[start:end]):
+                lines.append(self._items[i].to_hyperlink('..'))
+            
+            # pager
+            if len(pages)>1:
+                pager = []
+                if k>0: pager.append(f'[« 上一页]({pages[k-1][0]})')
+                if k<len(pages)-1: pager.append(f'[下一页 »]({pages[k+1][0]})')
+                lines.append('\n' + ' | '.join(pager))
+
+            yield f'{dir_name}/{filename}', '\n'.join(lines)
+
+
+    def _page_filenames(self, name:str, count:int) -> list:
+        '''File names of summary pages of ``count`` posts, from the newest page.'''
+        return [filename for filename, _, _ in self._page_slices(name, count)]
+
+
+    def _page_slices(self, name:str, count:int) -> list:
+        '''Pairs of (file name, start, end) of summary pages from the newest one, where posts 
+        ``[start, end)`` are counted from the oldest.
+        '''
+        base = to_dir_name(name)
+        if not self.page_size: return [(f'{base}.md', 0, count)]
+        pages = max(1, -(-count//self.page_size))
+        slices = [(f'{base}-{k+1}.md', k*self.page_size, (k+1)*self.page_size) for k in range(pages-1)]
+        slices.append((f'{base}.md', (pages-1)*self.page_size, count))
+        return slices[::-1]
+
+
+    def _write_page(self, page_path:str, text:str):
+        '''Write page if changed, and keep its hash to recognize it in next build.'''
+        key = os.path.relpath(page_path, self.docs_dir)
+        self.manifest.pages[key] = self.writer.write(page_path, text)
+
+
+    def _write_xml(self, filename:str, inputs, chunks):
+        '''Stream XML page to docs unless it exists and the signature of its ``inputs`` equals
+        the one kept in manifest, so nothing is rendered or read for an unchanged page.
+        '''
+        sha = hashlib.sha1()
+        for item in inputs: sha.update(f'{item}\n'.encode('utf-8'))
+        signature = sha.hexdigest()
+        page_path = os.path.join(self.docs_dir, filename)
+        if self.manifest.pages.get(filename)==signature and os.path.isfile(page_path):
+            self.writer.skipped += 1
+        else:
+            self.writer.write_stream(page_path, chunks)
+            self.manifest.pages[filename] = signature
+
+
+    def _iter_sitemap_urls(self, site_url:str, use_directory_urls:bool=True):
+        '''Pairs of (url, date of newest post in it) of home page, summary pages and posts.'''
+        date = lambda i: '{0.year}-{0.month}-{0.day}'.format(self._items[i])
+        latest = self._get_latest(1)
+        newest = f'{latest[0].year}-{latest[0].month}-{latest[0].day}' if latest else None
+        to_url = lambda rel_path: self._to_url(site_url, rel_path, use_directory_urls)
+
+        yield to_url(Posts.INDEX_FILENAME), newest
+        yield to_url(Posts.ARCHIVE_FILENAME), newest
+        if self._is_nav_limited(): yield to_url(Posts.CATEGORY_FILENAME), newest
+        if os.path.isfile(os.path.join(self.docs_dir, Posts.ABOUT_FILENAME)): 
+            yield to_url(Posts.ABOUT_FILENAME), None
+        
+        # summary pages, dated by the first post of each page
+        for names, dir_name in ((self._categories, self.category_dir_name), (self._years, self.archive_dir_name)):
+            for name in sorted(names):
+                ids = names[name]
+                if not ids: continue
+                for filename, _, end in self._page_slices(name, len(ids)):
+                    yield to_url(f'{dir_name}/{filename}'), date(ids[end-1])
+        
+        # posts from newest to oldest
+        for post in self.iter_posts():
+            yield to_url(os.path.basename(post.post_path)), f'{post.year}-{post.month}-{post.day}'
+
+
+    @staticmethod
+    def _to_url(site_url:str, rel_path:str, use_directory_urls:bool=True) -> str:
+        '''Absolute url of page ``rel_path`` relative to docs, the way mkdocs builds it.'''
+        return f'{site_url.rstrip("/")}/{Posts._to_path(rel_path, use_directory_urls)}'
+
+
+    @staticmethod
+    def _to_path(rel_path:str, use_directory_urls:bool=True) -> str:
+        '''Url of page ``rel_path`` relative to docs, i.e. relative to site root.'''
+        if rel_path.endswith('.md'):
+            path = rel_path[:-3]
+            if use_directory_urls:
+                path = '' if path=='index' else f'{path[:-5] if path.endswith("/index") else path}/'
+            else:
+                path += '.html'
+        else:
+            path = rel_path
+        return quote(path)
+
+
+    @staticmethod
+    def _xml_writer() -> tuple:
+        '''XML writer and its buffer, flushed by ``_xml_flush()`` after each element so that 
+        output is streamed.
+        '''
+        buffer = io.StringIO()
+        xml = XMLGenerator(buffer, encoding='utf-8', short_empty_elements=True)
+        xml.startDocument()
+        return xml, buffer
+
+
+    @staticmethod
+    def _xml_flush(buffer:io.StringIO) -> str:
+        text = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return text
+
+
+    @staticmethod
+    def _xml_element(xml:XMLGenerator, name:str, text:str=None, attrs:dict=None):
+        xml.startElement(name, attrs or {})
+        if text: xml.characters(text)
+        xml.endElement(name)
+
+
+    def _remove_stale_pages(self, page_dir:str, names:dict):
+        '''Remove pages left by categories/years not existing any more, or by pages beyond
+        current count of posts.
+        '''
+        valid = set()
+        for name in names: valid.update(self._page_filenames(name, len(names[name])))
+        for filename in os.listdir(page_dir):
+            if filename in valid: continue
+            page_path = os.path.join(page_dir, filename)
+            if os.path.isfile(page_path): os.remove(page_path)
+            self.manifest.pages.pop(os.path.relpath(page_path, self.docs_dir), None)
+
+
+
+class PageWriter:
+    '''Output layer of all generated pages: a page is written only if its content changes,
+    and it's written to a temporary file first, then renamed to the target atomically.
+    '''
+    def __init__(self) -> None:
+        self.written = 0
+        self.skipped = 0
+        self.bytes_written = 0
+        self.files_read = 0   # existing files read for comparison
+        self.bytes_read = 0
+
+
+    def write(self, file_path:str, text:str) -> str:
+        '''Write text to file if changed. Return sha1 of the content. The content is compared
+        with the existing file in memory, so no temporary file is created for unchanged page,
+        e.g. in the watched ``docs`` when serving.
+        '''
+        data = text.encode('utf-8')
+        if self._same_bytes(file_path, data):
+            self.skipped += 1
+            return hashlib.sha1(data).hexdigest()
+        return self._replace(file_path, [data])
+
+
+    def write_stream(self, file_path:str, chunks) -> str:
+        '''Write text chunks to file if changed. The target file can be read by ``chunks``
+        when writing, since it's replaced only after all chunks are consumed.
+        '''
+        return self._replace(file_path, (chunk.encode('utf-8') for chunk in chunks), compare=True)
+
+
+    def _replace(self, file_path:str, blocks, compare:bool=False) -> str:
+        '''Write bytes blocks to a temporary file, then replace the target with it unless 
+        ``compare`` and the content is same.
+        '''
+        sha = hashlib.sha1()
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(file_path) or '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for data in blocks:
+                    sha.update(data)
+                    f.write(data)
+                size = f.tell()
+            digest = sha.hexdigest()
+
+            if compare and self._same_file(file_path, size, digest):
+                os.remove(tmp_path)
+                self.skipped += 1
             else:
-                posts.extend(year_posts)
-                need -= year_cnt
-        return posts
+                # keep permission of existing file; temporary file is private by default
+                os.chmod(tmp_path, os.stat(file_path).st_mode if os.path.exists(file_path) else 0o644)
+                os.replace(tmp_path, file_path)
+                self.written += 1
+                self.bytes_written += size
+        except BaseException:
+            if os.path.exists(tmp_path): os.remove(tmp_path)
+            raise
+
+        return digest
+    
+
+    def summary(self) -> str:
+        return f'{self.written} pages written, {self.skipped} pages unchanged.'
+
+
+    def _same_file(self, file_path:str, size:int, digest:str):
+        '''Compare size first, then the hash of existing file.'''
+        if not os.path.isfile(file_path) or os.path.getsize(file_path)!=size: return False
+        sha = hashlib.sha1()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1<<16), b''):
+                sha.update(chunk)
+        self.files_read += 1
+        self.bytes_read += size
+        return sha.hexdigest()==digest
+
+
+    def _same_bytes(self, file_path:str, data:bytes):
+        '''Compare size first, then the content of existing file.'''
+        if not os.path.isfile(file_path) or os.path.getsize(file_path)!=len(data): return False
+        with open(file_path, 'rb') as f:
+            same = f.read()==data
+        self.files_read += 1
+        self.bytes_read += len(data)
+        return same
+
+
+
+class BuildReport:
+    '''Statistics of each phase of a build: wall time, files and bytes read and written, 
+    pages written and skipped, and the slowest posts to parse or rewrite. Optionally, the 
+    whole build is profiled with ``cProfile``.
+
+    ::
+        {
+            "seconds": 1.23,
+            "phases": [
+                {
+                    "name": "collect", "seconds": 0.45, 
+                    "files_read": 100, "bytes_read": 102400, 
+                    "pages_written": 0, "pages_skipped": 0, "bytes_written": 0
+                },
+                ...
+            ],
+            "slowest_posts": [{"post": "yyyy-mm-dd-title.md", "phase": "collect", "seconds": 0.01}, ...]
+        }
+    '''
+    def __init__(self, writer:PageWriter, slowest:int=10, profile_path:str=None) -> None:
+        self.writer = writer
+        self.slowest = slowest
+        self.phases = []
+        self.files_read = 0   # posts read
+        self.bytes_read = 0
+        self._phase = None
+        self._posts = []      # min-heap of (seconds, post, phase)
+        self._start = time.perf_counter()
+
+        self.profile_path = profile_path
+        self._profiler = None
+        if profile_path:
+            import cProfile
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+
+
+    @contextmanager
+    def phase(self, name:str):
+        '''Record statistics of code running in this context as a phase.'''
+        before = self._counters()
+        start = time.perf_counter()
+        self._phase = name
+        try:
+            yield
+        finally:
+            stats = {'name': name, 'seconds': time.perf_counter()-start}
+            stats.update((k, v-before[k]) for k, v in self._counters().items())
+            self.phases.append(stats)
+            self._phase = None
+
+
+    def read(self, size:int, files:int=1):
+        self.files_read += files
+        self.bytes_read += size
+
+
+    def time_post(self, filename:str, seconds:float):
+        '''Keep the slowest posts only.'''
+        item = (seconds, filename, self._phase)
+        if len(self._posts)<self.slowest:
+            heapq.heappush(self._posts, item)
+        elif self._posts and item>self._posts[0]:
+            heapq.heapreplace(self._posts, item)
+
+
+    def finish(self):
+        '''Stop profiling and dump the stats if required.'''
+        if self._profiler is None: return
+        self._profiler.disable()
+        self._profiler.dump_stats(self.profile_path)
+        self._profiler = None
+
+
+    def to_dict(self) -> dict:
+        return {
+            'seconds': time.perf_counter()-self._start,
+            'phases': self.phases,
+            'slowest_posts': [{'post': post, 'phase': phase, 'seconds': seconds} 
+                for seconds, post, phase in sorted(self._posts, reverse=True)]
+        }
+
+
+    def save(self, file_path:str):
+        with open(file_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+
+
+    def _counters(self) -> dict:
+        return {
+            'files_read': self.files_read + self.writer.files_read,
+            'bytes_read': self.bytes_read + self.writer.bytes_read,
+            'pages_written': self.writer.written,
+            'pages_skipped': self.writer.skipped,
+            'bytes_written': self.writer.bytes_written
+        }
+
+
+
+class Watcher:
+    '''Watch markdown files directly under a directory: inotify on Linux, otherwise polling.
+    
+    Iterate it to get names of created, modified, moved or deleted files in batches.
+    '''
+    # inotify events
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM  = 0x00000040
+    IN_MOVED_TO    = 0x00000080
+    IN_CREATE      = 0x00000100
+    IN_DELETE      = 0x00000200
+
+    def __init__(self, watch_dir:str, interval:float=1.0, delay:float=0.05) -> None:
+        '''
+        Args:
+            interval (float): seconds between two scans when polling.
+            delay (float): seconds to collect more events into current batch.
+        '''
+        self.watch_dir = watch_dir
+        self.interval = interval
+        self.delay = delay
+        self._fd = self._init_inotify()
+    
+
+    @property
+    def mode(self):
+        return 'polling' if self._fd is None else 'inotify'
+
+
+    def __iter__(self):
+        return self._iter_inotify() if self._fd is not None else self._iter_polling()
+
+
+    def close(self):
+        if self._fd is not None: os.close(self._fd)
+        self._fd = None
+
+
+    def _init_inotify(self):
+        try:
+            import ctypes, ctypes.util
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            fd = libc.inotify_init()
+        except (OSError, AttributeError):
+            return None
+        if fd<0: return None
+
+        mask = Watcher.IN_CLOSE_WRITE | Watcher.IN_MOVED_FROM | Watcher.IN_MOVED_TO | \
+                Watcher.IN_CREATE | Watcher.IN_DELETE
+        if libc.inotify_add_watch(fd, os.fsencode(self.watch_dir), mask)<0:
+            os.close(fd)
+            return None
+        return fd
+
+
+    def _iter_inotify(self):
+        while True:
+            filenames = set()
+            timeout = None # block until the first event
+            while select.select([self._fd], [], [], timeout)[0]:
+                filenames.update(self._read_events())
+                timeout = self.delay
+            if filenames: yield filenames
+
+
+    def _read_events(self):
+        # struct inotify_event: int wd; uint32_t mask, cookie, len; char name[len]
+        buf = os.read(self._fd, 1<<16)
+        i = 0
+        while i<len(buf):
+            _, _, _, size = struct.unpack_from('iIII', buf, i)
+            name = buf[i+16:i+16+size].rstrip(b'\0').decode('utf-8', errors='ignore')
+            i += 16 + size
+            if name.endswith('.md'): yield name
+
+
+    def _iter_polling(self):
+        snapshot = self._snapshot()
+        while True:
+            time.sleep(self.interval)
+            current = self._snapshot()
+            filenames = {name for name in snapshot.keys() | current.keys() \
+                            if snapshot.get(name)!=current.get(name)}
+            snapshot = current
+            if filenames: yield filenames
+
+
+    def _snapshot(self):
+        with os.scandir(self.watch_dir) as it:
+            return {entry.name: (entry.stat().st_mtime_ns, entry.stat().st_size) for entry in it \
+                        if entry.name.endswith('.md') and entry.is_file()}
+
+
+
+class Manifest:
+    '''Persistent build manifest, so that only changed posts are parsed and only changed 
+    summary pages are written in next build.
+
+    ::
+        {
+            "version": 4,
+            "posts": {
+                "yyyy-mm-dd-title.md": {
+                    "mtime": 1629000000000000000, "size": 1024, "hash": "sha1 of file",
+                    "source_hash": "sha1 of file before it's rewritten with meta-data",
+                    "year": "yyyy", "month": "mm", "day": "dd", "title": "title",
+                    "meta": ["categories: [foo]", ...], "categories": ["foo"], 
+                    "offset": 128, "rewritten": false
+                },
+                ...
+            },
+            "pages": {
+                "categories/foo.md": "sha1 of page",
+                "feed.xml": "sha1 of inputs, i.e. what the page is generated from",
+                ...
+            }
+        }
+    '''
+    VERSION = 4
 
+    def __init__(self, file_path:str=None) -> None:
+        self.file_path = file_path
+        self.posts, self.pages = {}, {}
+        if not file_path or not os.path.isfile(file_path): return
+
+        # ignore broken or outdated manifest, which leads to a full build
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get('version')!=Manifest.VERSION: return
+        self.posts = data.get('posts', {})
+        self.pages = data.get('pages', {})
 
-    def _to_summary_page(self, category:str, page_dir:str):
-        '''Store summary page under page_dir/category.md.'''
-        lines = [f'## {category}\n\n']
-        for post in self._posts.get(category, []):
-            lines.append(post.to_hyperlink('..'))
-        text = '\n'.join(lines)
 
-        with open(os.path.join(page_dir, f'{to_dir_name(category)}.md'), 'w', encoding='utf-8') as f:
-            f.write(text)
+    def save(self):
+        if not self.file_path: return
+        data = {
+            'version': Manifest.VERSION,
+            'posts': self.posts,
+            'pages': self.pages
+        }
+        with open(self.file_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
 
 
 
 class ConfigFile:
+
+    # generated content is appended after this line
+    MARKER = '# generated by run.py'
+
     def __init__(self, file_path) -> None:
         self.file_path = file_path
-        # read content
+        # read content, excluding the generated part, e.g. navigation, in previous run
         with open(file_path, 'r', encoding='utf-8') as f:
             self.content = f.read()
+        pos = self.content.find(f'\n{ConfigFile.MARKER}\n')
+        if pos>=0: self.content = self.content[:pos]
 
     def get_site_info(self):
         pattern = re.compile(r'site_name:(?P<site>.*)\n(.*)site_description:(?P<desp>.*)\n')
         match = pattern.search(self.content)
         if match:
-            site = match.group('site').strip()
-            description = match.group('desp').strip()
-        else:
-            site = 'My Blog'
-            description = 'Welcome to my blog'
+            return ConfigFile.to_site_info(match.group('site').strip(), match.group('desp').strip())
+        return ConfigFile.to_site_info()
+
+
+    def get_value(self, key:str, default:str=None):
+        '''Value of a top level scalar option, e.g. ``site_url``.'''
+        match = re.search(rf'^{key}:\s*(["\']?)(.*?)\1\s*(#.*)?$', self.content, re.M)
+        return match.group(2) if match and match.group(2) else default
+
+
+    def get_toc_separator(self):
+        '''Word separator of heading anchors, i.e. option ``separator`` of ``toc`` extension.'''
+        match = re.search(r'^\s+separator:\s*(["\']?)(.*?)\1\s*(#.*)?$', self.content, re.M)
+        return match.group(2) if match else '-'
+
+
+    @staticmethod
+    def to_site_info(site:str='My Blog', description:str='Welcome to my blog'):
+        '''Title area of home page.'''
         return f'# {site}\n\n{description}\n\n---\n\n'
 
 
-    def update(self, more_content):
-        with open(self.file_path, 'w', encoding='utf-8') as f:
-            f.write(self.content + '\n' + more_content)
+    def update(self, more_content, writer:'PageWriter'=None):
+        writer = writer or PageWriter()
+        writer.write(self.file_path, f'{self.content}\n{ConfigFile.MARKER}\n{more_content}')
+
+
 
+class Images:
+    '''Image assets pipeline on the build directory:
+
+    * prune images not referenced by any page
+    * deduplicate identical images by content hash, i.e. hard link to the same file
+    * replace images with downscaled/recompressed variants, which are generated in a process 
+      pool and cached by the hash of source image, so they are never generated twice
+
+    Images are replaced by renaming rather than written in place, since they are hard linked
+    to the source images by ``sync()``. Requires ``Pillow`` to generate variants.
+    '''
+    # ![alt](path "title") or <img src="path">
+    LINK_PATTERN = re.compile(r'''!\[[^\]]*\]\(\s*<?([^)\s>]+)|<img\s[^>]*?src\s*=\s*["']([^"']+)["']''', re.I)
+    EXTENSIONS = ('.jpg', '.jpeg', '.png')
+    MANIFEST_FILENAME = 'manifest.json'
+
+    def __init__(self, docs_dir:str, cache_dir:str, images_dir_name:str='images', 
+                max_width:int=1200, quality:int=85, workers:int=None) -> None:
+        '''
+        Args:
+            docs_dir (str): docs directory in build.
+            cache_dir (str): directory storing generated variants and the manifest.
+            max_width (int): images wider than it are downscaled.
+            quality (int): quality of recompressed JPEG images.
+            workers (int): count of processes generating variants, cpu count by default.
+        '''
+        self.docs_dir = docs_dir
+        self.images_dir = os.path.join(docs_dir, images_dir_name)
+        self.cache_dir = cache_dir
+        self.max_width = max_width
+        self.quality = quality
+        self.workers = workers
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # pages: rel_path -> [mtime, size, [referenced images]]
+        # images: rel_path -> [mtime, size, sha1]
+        # variants: sha1 -> [variant filename, sha1 of variant], or None if no gain
+        self._manifest_path = os.path.join(cache_dir, Images.MANIFEST_FILENAME)
+        try:
+            with open(self._manifest_path, 'r', encoding='utf-8') as f:
+                self._manifest = json.load(f)
+        except (OSError, ValueError):
+            self._manifest = {'pages': {}, 'images': {}, 'variants': {}}
+        
+        self.counts = defaultdict(int)
+
+
+    def run(self, prune:bool=True):
+        if not os.path.isdir(self.images_dir): return
+        images = self._hash_images()
+
+        # prune unreferenced images
+        if prune:
+            referenced = self._referenced_images()
+            for rel_path in list(images):
+                if rel_path in referenced: continue
+                os.remove(os.path.join(self.docs_dir, rel_path))
+                images.pop(rel_path)
+                self.counts['pruned'] += 1
+        
+        # group identical images
+        groups = defaultdict(list)
+        for rel_path, digest in sorted(images.items()):
+            groups[digest].append(rel_path)
+        
+        # generate variants for each unique image
+        self._make_variants({digest: paths[0] for digest, paths in groups.items()})
+
+        # replace with variants or deduplicate by hard link
+        for digest, paths in groups.items():
+            variant = self._manifest['variants'].get(digest)
+            if variant:
+                source = os.path.join(self.cache_dir, variant[0])
+                digest = variant[1]
+            else:
+                source = os.path.join(self.docs_dir, paths[0])
+            for rel_path in (paths if variant else paths[1:]):
+                image_path = os.path.join(self.docs_dir, rel_path)
+                if not os.path.samefile(source, image_path):
+                    Images._link(source, image_path)
+                    self.counts['replaced' if variant else 'deduplicated'] += 1
+                stat = os.stat(image_path)
+                self._manifest['images'][rel_path] = [stat.st_mtime_ns, stat.st_size, digest]
+        
+        with open(self._manifest_path, 'w', encoding='utf-8') as f:
+            json.dump(self._manifest, f, ensure_ascii=False)
+
+
+    def summary(self) -> str:
+        return ', '.join(f'{self.counts[k]} {k}' for k in ('pruned', 'deduplicated', 'generated', 'replaced')) + '.'
+
+
+    def _hash_images(self) -> dict:
+        '''Content hash of images, reusing cached hash if stat not changed. Note the stat 
+        is changed once the image is replaced with variant, so it's cached after replacing.
+        '''
+        cached, records, images = self._manifest['images'], {}, {}
+        for root, _, filenames in os.walk(self.images_dir):
+            for filename in filenames:
+                if not filename.lower().endswith(Images.EXTENSIONS): continue
+                image_path = os.path.join(root, filename)
+                rel_path = os.path.relpath(image_path, self.docs_dir).replace(os.sep, '/')
+                stat = os.stat(image_path)
+                record = cached.get(rel_path)
+                if not record or record[:2]!=[stat.st_mtime_ns, stat.st_size]:
+                    with open(image_path, 'rb') as f:
+                        record = [stat.st_mtime_ns, stat.st_size, hashlib.sha1(f.read()).hexdigest()]
+                records[rel_path] = record
+                images[rel_path] = record[2]
+        self._manifest['images'] = records
+        return images
+
+
+    def _referenced_images(self) -> set:
+        '''Images referenced by all markdown pages, which are scanned only if changed.'''
+        cached, pages, referenced = self._manifest['pages'], {}, set()
+        for root, _, filenames in os.walk(self.docs_dir):
+            for filename in filenames:
+                if not filename.endswith('.md'): continue
+                page_path = os.path.join(root, filename)
+                rel_path = os.path.relpath(page_path, self.docs_dir).replace(os.sep, '/')
+                stat = os.stat(page_path)
+                record = cached.get(rel_path)
+                if not record or record[:2]!=[stat.st_mtime_ns, stat.st_size]:
+                    record = [stat.st_mtime_ns, stat.st_size, self._scan_page(page_path)]
+                pages[rel_path] = record
+                referenced.update(record[2])
+        self._manifest['pages'] = pages
+        return referenced
+
+
+    def _scan_page(self, page_path:str) -> list:
+        '''Image paths relative to docs directory referenced by a page.'''
+        page_dir = os.path.dirname(page_path)
+        refs = set()
+        with open(page_path, 'r', encoding='utf-8', errors='ignore') as f:
+            for line in f:
+                for match in Images.LINK_PATTERN.finditer(line):
+                    url = unquote((match.group(1) or match.group(2)).split('#')[0].split('?')[0])
+                    if not url or '://' in url or url.startswith('data:'): continue
+                    path = os.path.join(self.docs_dir, url.lstrip('/')) if url.startswith('/') \
+                            else os.path.join(page_dir, url)
+                    refs.add(os.path.relpath(os.path.normpath(path), self.docs_dir).replace(os.sep, '/'))
+        return sorted(refs)
+
+
+    def _make_variants(self, images:dict):
+        '''Generate variants for images, i.e. sha1 -> rel_path, not processed before.'''
+        variants = self._manifest['variants']
+        todo = {digest: rel_path for digest, rel_path in images.items() \
+                    if digest not in variants or \
+                        variants[digest] and not os.path.isfile(os.path.join(self.cache_dir, variants[digest][0]))}
+        if not todo: return
+        if importlib.util.find_spec('PIL') is None:
+            print('Pillow is not installed, so image variants are not generated.')
+            return
+        
+        args = [(os.path.join(self.docs_dir, rel_path), 
+                    os.path.join(self.cache_dir, digest + os.path.splitext(rel_path)[1].lower()),
+                    self.max_width, self.quality) for digest, rel_path in todo.items()]
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            for digest, variant in zip(todo, executor.map(Images._make_variant, *zip(*args))):
+                variants[digest] = variant
+                if not variant: continue
+                variants[variant[1]] = None # variant itself needn't to be processed again
+                self.counts['generated'] += 1
+
+
+    @staticmethod
+    def _make_variant(image_path:str, variant_path:str, max_width:int, quality:int):
+        '''Downscale and recompress image. Return file name and hash of variant, or None if no gain.'''
+        from PIL import Image
+        with Image.open(image_path) as image:
+            if image.width>max_width:
+                height = round(image.height * max_width / image.width)
+                image = image.resize((max_width, height), Image.LANCZOS)
+            if variant_path.endswith('.png'):
+                image.save(variant_path, optimize=True)
+            else:
+                image.convert('RGB').save(variant_path, quality=quality, optimize=True, progressive=True)
+        
+        if os.path.getsize(variant_path)<os.path.getsize(image_path):
+            with open(variant_path, 'rb') as f:
+                return [os.path.basename(variant_path), hashlib.sha1(f.read()).hexdigest()]
+        os.remove(variant_path)
+        return None
+
+
+    @staticmethod
+    def _link(src_path:str, dst_path:str):
+        '''Replace dst with hard link to src, copy if not supported. Nothing to do if dst is 
+        linked to src already, in which case ``os.replace()`` would keep the temporary link.
+        '''
+        tmp_path = dst_path + '.tmp'
+        if os.path.lexists(tmp_path): os.remove(tmp_path) # left by an interrupted run
+        if os.path.exists(dst_path) and os.path.samefile(src_path, dst_path): return
+        try:
+            os.link(src_path, tmp_path)
+        except OSError:
+            shutil.copy2(src_path, tmp_path)
+        os.replace(tmp_path, dst_path)
+
+
+
+class SearchIndex:
+    '''Offline inverted index of posts, sharded into small JSON files which are fetched lazily
+    by browser (see ``docs/js/search.js``), so neither the initial download nor a query needs
+    the whole index.
+
+    ::
+        search-index/
+            meta.json       {"shards": 64, "docs_per_shard": 128}
+            terms-0.json    {"term": [[doc_id, weight], ...], ...}
+            docs-0.json     {"doc_id": ["url", "title", "yyyy-mm-dd"], ...}
+
+    * The client is opt-in: ``search.js`` is not loaded by ``mkdocs.yml``, where the built-in 
+      search plugin is used. Urls of documents are relative to site root, built the same way 
+      as feed and sitemap according to ``use_directory_urls``.
+    * Terms are character bigrams of CJK text and lower-cased words of Latin text. A term is 
+      stored in shard ``fnv1a(term) % shards``, while a document in ``doc_id // docs_per_shard``.
+    * The terms of each post are cached with its source hash, which is kept when the post is 
+      rewritten, so only changed posts are tokenized again, and only the shards containing 
+      their old or new terms are rewritten.
+    '''
+    TERM_PATTERN = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+|[a-z0-9_]+')
+    TITLE_WEIGHT = 5
+
+    def __init__(self, index_dir:str, cache_path:str, writer:'PageWriter'=None, 
+                shards:int=64, docs_per_shard:int=128, use_directory_urls:bool=True) -> None:
+        self.index_dir = index_dir
+        self.cache_path = cache_path
+        self.writer = writer or PageWriter()
+        self.shards = shards
+        self.docs_per_shard = docs_per_shard
+        self.use_directory_urls = use_directory_urls
+        self.files_read = 0   # posts read
+        self.bytes_read = 0
+    
+
+    @staticmethod
+    def tokenize(text:str, weight:int=1, terms:dict=None) -> dict:
+        '''Count terms: bigrams of CJK characters, words of Latin text.'''
+        terms = defaultdict(int) if terms is None else terms
+        for match in SearchIndex.TERM_PATTERN.finditer(text.lower()):
+            token = match.group()
+            if token.isascii():
+                if len(token)>1: terms[token] += weight
+            elif len(token)==1:
+                terms[token] += weight
+            else:
+                for i in range(len(token)-1):
+                    terms[token[i:i+2]] += weight
+        return terms
+
+
+    @staticmethod
+    def fnv1a(term:str) -> int:
+        '''32-bit FNV-1a hash over code points, same as the one in ``search.js``.'''
+        h = 0x811c9dc5
+        for c in term:
+            h = ((h ^ ord(c)) * 0x01000193) & 0xffffffff
+        return h
+
+
+    def update(self, posts):
+        '''Update index with current posts: changed posts are indexed again, removed posts
+        are dropped from index.
+        '''
+        os.makedirs(self.index_dir, exist_ok=True)
+        cache = self._load_cache()
+        cached = cache['posts'] # filename -> [hash, doc_id, [terms]]
+
+        changed_terms = defaultdict(dict) # shard -> {term: None}, i.e. ordered set
+        changed_docs  = defaultdict(dict) # shard -> {doc_id: entry or None}
+        added = {} # doc_id -> {term: weight}
+        current = set()
+        for post in posts:
+            filename = os.path.basename(post.post_path)
+            current.add(filename)
+            old = cached.get(filename)
+            if old and old[0]==post.source_hash: continue
+
+            # index changed post with the same doc id
+            if old:
+                doc_id = old[1]
+                for term in old[2]: changed_terms[self._term_shard(term)][term] = None
+            else:
+                doc_id = cache['next_id']
+                cache['next_id'] += 1
+            terms = SearchIndex.tokenize(post.title or '', SearchIndex.TITLE_WEIGHT)
+            for line in post.iter_content():
+                SearchIndex.tokenize(line, 1, terms)
+            self.files_read += 1
+            self.bytes_read += post.content_size()
+            for term in terms: changed_terms[self._term_shard(term)][term] = None
+            added[doc_id] = terms
+            
+            url = Posts._to_path(filename, self.use_directory_urls)
+            changed_docs[doc_id // self.docs_per_shard][doc_id] = [url, post.title, f'{post.year}-{post.month}-{post.day}']
+            cached[filename] = [post.source_hash, doc_id, sorted(terms)]
+        
+        # removed posts
+        for filename in cached.keys() - current:
+            _, doc_id, terms = cached.pop(filename)
+            for term in terms: changed_terms[self._term_shard(term)][term] = None
+            changed_docs[doc_id // self.docs_per_shard][doc_id] = None
+        
+        # update affected term shards: drop postings of changed docs, then add new ones
+        changed_ids = {doc_id for entries in changed_docs.values() for doc_id in entries}
+        for shard, terms in changed_terms.items():
+            data = self._load_shard(f'terms-{shard}.json')
+            for term in terms:
+                postings = [p for p in data.get(term, []) if p[0] not in changed_ids]
+                postings.extend([doc_id, weights[term]] for doc_id, weights in added.items() if term in weights)
+                if postings:
+                    data[term] = sorted(postings, key=lambda p: (-p[1], p[0]))
+                else:
+                    data.pop(term, None)
+            self._write_shard(f'terms-{shard}.json', data)
+        
+        # update affected doc shards
+        for shard, entries in changed_docs.items():
+            data = self._load_shard(f'docs-{shard}.json')
+            for doc_id, entry in entries.items():
+                if entry:
+                    data[str(doc_id)] = entry
+                else:
+                    data.pop(str(doc_id), None)
+            self._write_shard(f'docs-{shard}.json', data)
+        
+        self._write_shard('meta.json', {'shards': self.shards, 'docs_per_shard': self.docs_per_shard})
+        with open(self.cache_path, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, ensure_ascii=False)
+
+
+    def _term_shard(self, term:str) -> int:
+        return SearchIndex.fnv1a(term) % self.shards
+
+
+    def _load_cache(self):
+        '''Load cache, or start a full rebuild if shard settings or urls changed.'''
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+            if cache['shards']==self.shards and cache['docs_per_shard']==self.docs_per_shard and \
+                cache['use_directory_urls']==self.use_directory_urls and \
+                os.path.isfile(os.path.join(self.index_dir, 'meta.json')):
+                return cache
+        except (OSError, ValueError, KeyError):
+            pass
+
+        for filename in os.listdir(self.index_dir):
+            if filename.endswith('.json'): os.remove(os.path.join(self.index_dir, filename))
+        os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)), exist_ok=True)
+        return {'shards': self.shards, 'docs_per_shard': self.docs_per_shard, 
+                'use_directory_urls': self.use_directory_urls, 'next_id': 0, 'posts': {}}
+
+
+    def _load_shard(self, filename:str) -> dict:
+        try:
+            with open(os.path.join(self.index_dir, filename), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+
+    def _write_shard(self, filename:str, data:dict):
+        text = json.dumps(data, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+        self.writer.write(os.path.join(self.index_dir, filename), text)
+
+
+
+class RelatedPosts:
+    '''Related posts by cosine similarity of TF-IDF vectors, computed at build time.
+
+    * Terms are the same as ``SearchIndex``, i.e. CJK bigrams and Latin words, weighted by 
+      sublinear term frequency and inverse document frequency. Terms found in only one post 
+      or in more than ``max_df`` of posts are dropped, and each vector keeps its ``max_terms`` 
+      heaviest terms, so that vectors are sparse.
+    * Similarities are sparse matrix products ``X X^T``, in blocks of rows with ``scipy`` if 
+      available, otherwise row by row along the postings of an inverted index. Either way, 
+      only posts sharing terms are ever compared.
+    * Term counts are cached with the source hash of post, which is kept when the post is 
+      rewritten, so only changed posts are tokenized again; related posts of last build are 
+      cached too, to find the posts to be rewritten.
+    '''
+    CACHED_TERMS = 256
+    BLOCK_SIZE = 1024
+
+    def __init__(self, cache_path:str, count:int=5, max_terms:int=64, max_df:float=0.5, 
+                min_score:float=0.1) -> None:
+        self.cache_path = cache_path
+        self.count = count
+        self.max_terms = max_terms
+        self.max_df = max_df
+        self.min_score = min_score
+        self.related = {} # filename -> [filename of related posts]
+        self.changed = set() # posts with different related posts than last build
+        self.files_read = 0   # posts read
+        self.bytes_read = 0
+    
+
+    def get(self, filename:str) -> list:
+        return self.related.get(filename, [])
+
+
+    def update(self, posts):
+        '''Compute related posts of current posts.'''
+        cache = self._load_cache()
+        cached = cache['posts'] # filename -> [hash, {term: count}]
+        names, counts = [], []
+        for post in posts:
+            filename = os.path.basename(post.post_path)
+            old = cached.get(filename)
+            if not old or old[0]!=post.source_hash:
+                terms = SearchIndex.tokenize(post.title or '', SearchIndex.TITLE_WEIGHT)
+                for line in post.iter_content():
+                    SearchIndex.tokenize(line, 1, terms)
+                self.files_read += 1
+                self.bytes_read += post.content_size()
+                terms = dict(heapq.nlargest(self.CACHED_TERMS, sorted(terms.items()), key=lambda x: x[1]))
+                old = cached[filename] = [post.source_hash, terms]
+            names.append(filename)
+            counts.append(old[1])
+        
+        # drop removed posts
+        current = set(names)
+        for filename in cached.keys() - current: del cached[filename]
+
+        # related posts, and the ones changed since last build
+        vectors = self._vectorize(counts)
+        try:
+            rows = self._iter_scores_scipy(vectors)
+        except ImportError:
+            rows = self._iter_scores(vectors)
+        
+        self.related = {}
+        for i, scores in enumerate(rows):
+            top = heapq.nlargest(self.count, ((score, names[j]) for j, score in scores 
+                                              if j!=i and score>=self.min_score))
+            self.related[names[i]] = [name for _, name in top]
+        last = cache['related']
+        self.changed = {name for name in names if last.get(name, [])!=self.related[name]}
+
+        cache['related'] = self.related
+        with open(self.cache_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(cache, ensure_ascii=False))
+
+
+    def _iter_scores(self, vectors:list):
+        '''Yield (post index, score) pairs of each row of ``X X^T``, accumulated along postings.'''
+        postings = defaultdict(list) # term -> [(post index, weight)]
+        for i, vector in enumerate(vectors):
+            for term, weight in vector.items(): postings[term].append((i, weight))
+        
+        for vector in vectors:
+            scores = defaultdict(float)
+            for term, weight in vector.items():
+                for j, w in postings[term]: scores[j] += weight * w
+            yield scores.items()
+
+
+    def _iter_scores_scipy(self, vectors:list):
+        '''Same as ``_iter_scores()``, but ``X X^T`` is computed by ``scipy.sparse`` in blocks 
+        of rows, so the memory is bounded. It's not a generator itself, so that ``ImportError`` 
+        is raised when it's called rather than iterated.
+        '''
+        import numpy as np
+        from scipy import sparse
+
+        vocabulary, indptr, indices, data = {}, [0], [], []
+        for vector in vectors:
+            for term, weight in vector.items():
+                indices.append(vocabulary.setdefault(term, len(vocabulary)))
+                data.append(weight)
+            indptr.append(len(indices))
+        X = sparse.csr_matrix((np.array(data), np.array(indices, dtype=np.int64), np.array(indptr)), 
+                              shape=(len(vectors), len(vocabulary)))
+        XT = X.T.tocsr()
+
+        # only the top candidates of each row are yielded, i.e. ``count`` and itself
+        k = self.count + 1
+        def iter_rows():
+            for start in range(0, X.shape[0], self.BLOCK_SIZE):
+                S = (X[start:start+self.BLOCK_SIZE] @ XT).tocsr()
+                for r in range(S.shape[0]):
+                    columns, scores = S.indices[S.indptr[r]:S.indptr[r+1]], S.data[S.indptr[r]:S.indptr[r+1]]
+                    if len(scores)>k:
+                        top = np.argpartition(scores, -k)[-k:]
+                        columns, scores = columns[top], scores[top]
+                    yield zip(columns.tolist(), scores.tolist())
+        return iter_rows()
+
+
+    def _vectorize(self, counts:list) -> list:
+        '''Normalized TF-IDF vectors, i.e. {term: weight}, of term counts.'''
+        df = defaultdict(int)
+        for terms in counts:
+            for term in terms: df[term] += 1
+        n = len(counts)
+        idf = {term: math.log(n/k) for term, k in df.items() if 1<k<=self.max_df*n}
+
+        vectors = []
+        for terms in counts:
+            weights = {t: (1+math.log(c))*idf[t] for t, c in terms.items() if t in idf}
+            weights = dict(heapq.nlargest(self.max_terms, weights.items(), key=lambda x: x[1]))
+            norm = math.sqrt(sum(w*w for w in weights.values())) or 1.0
+            vectors.append({t: w/norm for t, w in weights.items()})
+        return vectors
+
+
+    def _load_cache(self) -> dict:
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+            if 'posts' in cache and 'related' in cache: return cache
+        except (OSError, ValueError):
+            pass
+        os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)), exist_ok=True)
+        return {'posts': {}, 'related': {}}
+
+
+
+class LinkChecker:
+    '''Check internal links, images and anchors of posts against the files under docs and 
+    the heading anchors of pages.
+
+    * Links are extracted from each post, i.e. inline links/images (nested ones included), 
+      reference definitions, ``<a href>`` and ``<img src>``, skipping fenced and inline code. 
+      External links, e.g. ``https:``, ``mailto:``, are ignored.
+    * Anchors are generated from ATX headings in the same way as ``markdown.extensions.toc``, 
+      with the separator configured in mkdocs config.
+    * Extracting is done in a process pool and cached with content hash, so unchanged posts 
+      are not parsed again, while resolving links against current files is always done.
+    '''
+    INLINE_PATTERN = re.compile(r'(!?)\[([^\[\]]*)\]\(\s*<?([^)]*?)>?(?:\s+"[^"]*"|\s+\'[^\']*\')?\s*\)')
+    REFERENCE_PATTERN = re.compile(r'^ {0,3}\[([^\]^][^\]]*)\]:\s*<?([^\s>]+)')
+    HTML_PATTERN = re.compile(r'<(img|a)\s[^>]*?(?:src|href)\s*=\s*["\']([^"\']*)["\']', re.I)
+    HEADING_PATTERN = re.compile(r'^ {0,3}(#{1,6})\s+(.*?)(?:\s+#+)?\s*$')
+    FENCE_PATTERN = re.compile(r'^\s*(`{3,}|~{3,})') # fences in list are indented
+    CODE_PATTERN = re.compile(r'(`+).+?\1')
+    SCHEME_PATTERN = re.compile(r'^([a-z][a-z0-9+.-]*:|//)', re.I)
+
+    def __init__(self, docs_dir:str, cache_path:str, separator:str='-', workers:int=None) -> None:
+        '''
+        Args:
+            separator (str): word separator of heading anchors, i.e. option ``toc.separator``.
+            workers (int): count of processes extracting links, count of CPUs by default.
+        '''
+        self.docs_dir = docs_dir
+        self.cache_path = cache_path
+        self.separator = separator
+        self.workers = workers
+        self.broken = []
+        self.checked = 0
+        self.extracted = 0
+        self.bytes_read = 0   # posts extracted
+
+
+    @staticmethod
+    def slugify(text:str, separator:str='-') -> str:
+        '''Anchor of heading text, same as ``markdown.extensions.toc.slugify``.'''
+        text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii')
+        text = re.sub(r'[^\w\s-]', '', text).strip().lower()
+        return re.sub(r'[{}\s]+'.format(re.escape(separator)), separator, text)
+
+
+    @staticmethod
+    def extract(post_path:str, separator:str='-') -> tuple:
+        '''Links [line, kind, target] and heading anchors of a page.'''
+        links, anchors, fence = [], [], None
+        with open(post_path, 'r', encoding='utf-8') as f:
+            for i, line in enumerate(f, start=1):
+                # skip fenced code
+                match = LinkChecker.FENCE_PATTERN.match(line)
+                if match:
+                    mark = match.group(1)
+                    if fence is None: fence = mark
+                    elif mark[0]==fence[0] and len(mark)>=len(fence): fence = None
+                    continue
+                if fence: continue
+                line = LinkChecker.CODE_PATTERN.sub('', line)
+
+                # heading anchors: unique in page, with suffix _1, _2, ... otherwise
+                match = LinkChecker.HEADING_PATTERN.match(line)
+                if match:
+                    text = LinkChecker.INLINE_PATTERN.sub(lambda m: m.group(2), match.group(2))
+                    text = re.sub(r'[*_~`]', '', text)
+                    anchors.append(LinkChecker._unique(LinkChecker.slugify(text, separator), anchors))
+
+                # links: inner ones are replaced by placeholder so that outer ones are matched next
+                def collect(match):
+                    links.append([i, 'image' if match.group(1) else 'link', match.group(3)])
+                    return 'x'
+                while True:
+                    replaced = LinkChecker.INLINE_PATTERN.sub(collect, line)
+                    if replaced==line: break
+                    line = replaced
+                match = LinkChecker.REFERENCE_PATTERN.match(line)
+                if match: links.append([i, 'link', match.group(2)])
+                for match in LinkChecker.HTML_PATTERN.finditer(line):
+                    links.append([i, 'image' if match.group(1).lower()=='img' else 'link', match.group(2)])
+        
+        # internal links only
+        links = [link for link in links if link[2] and not LinkChecker.SCHEME_PATTERN.match(link[2])]
+        return links, anchors
+
+
+    def run(self, posts):
+        '''Check links of posts; broken ones are collected in ``self.broken``.'''
+        cache = self._load_cache() # filename -> [hash, links, anchors]
+        current = {os.path.basename(post.post_path): post for post in posts}
+        for filename in cache.keys() - current.keys(): del cache[filename]
+
+        # extract links of changed posts in parallel
+        changed = [name for name, post in current.items() if cache.get(name, [None])[0]!=post.hash]
+        paths = [current[name].post_path for name in changed]
+        separators = [self.separator] * len(paths)
+        if len(paths)>1:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                results = executor.map(LinkChecker.extract, paths, separators, chunksize=max(1, len(paths)//64))
+                for name, result in zip(changed, results): cache[name] = [current[name].hash, *result]
+        else:
+            for name, path in zip(changed, paths): cache[name] = [current[name].hash, *LinkChecker.extract(path, self.separator)]
+        self.extracted = len(changed)
+        self.bytes_read = sum(os.path.getsize(path) for path in paths)
+
+        # resolve links against current files and anchors
+        files = set()
+        for root, _, filenames in os.walk(self.docs_dir):
+            rel_dir = os.path.relpath(root, self.docs_dir)
+            files.update(os.path.normpath(os.path.join(rel_dir, filename)) for filename in filenames)
+        anchors = {name: set(entry[2]) for name, entry in cache.items()}
+
+        self.broken, self.checked = [], 0
+        for name in sorted(current):
+            for line, kind, target in cache[name][1]:
+                self.checked += 1
+                reason = self._resolve(name, target, files, anchors)
+                if reason: self.broken.append({'post': name, 'line': line, 'kind': kind, 
+                                               'target': target, 'reason': reason})
+
+        with open(self.cache_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(cache, ensure_ascii=False))
+
+
+    def summary(self) -> str:
+        return f'{self.checked} links checked, {len(self.broken)} broken, {self.extracted} posts parsed.'
+
+
+    def save(self, file_path:str):
+        data = {'checked': self.checked, 'broken': self.broken}
+        with open(file_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+    def _resolve(self, name:str, target:str, files:set, anchors:dict) -> str:
+        '''Reason if the link is broken, otherwise None.'''
+        path, _, anchor = unquote(target.split('?')[0]).partition('#')
+        if path:
+            path = path.lstrip('/') if path.startswith('/') else os.path.join(os.path.dirname(name), path)
+            path = os.path.normpath(path)
+            if path.startswith('..'): return 'outside docs'
+            if path not in files: return 'missing file'
+        else:
+            path = name
+        
+        # anchors are known for checked posts only
+        if anchor and path in anchors and anchor not in anchors[path]: return 'missing anchor'
+        return None
+
+
+    @staticmethod
+    def _unique(anchor:str, anchors:list) -> str:
+        while anchor in anchors or not anchor:
+            match = re.match(r'^(.*)_([0-9]+)$', anchor)
+            anchor = f'{match.group(1)}_{int(match.group(2))+1}' if match else f'{anchor}_1'
+        return anchor
+
+
+    def _load_cache(self) -> dict:
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)), exist_ok=True)
+            return {}
+
+
+
+class MathRenderer:
+    '''Pre-render math of built site to MathML, so that pages needn't typeset it in browser.
+
+    * Formulas are the ones marked by ``pymdownx.arithmatex``, i.e. ``<script type="math/tex">``
+      in ``<span class="arithmatex">`` or ``<div class="arithmatex">``, which are replaced 
+      with the MathML rendered by ``latex2mathml`` locally.
+    * Rendered formulas are cached by the hash of TeX and display mode, so only new formulas 
+      are rendered, in a process pool.
+    * MathJax is removed from pages once all formulas are rendered; pages with any formula 
+      failed to render keep both the formula and MathJax.
+    '''
+    FORMULA_PATTERN = re.compile(r'<(span|div) class="arithmatex">\s*<\1 class="MathJax_Preview">.*?</\1>\s*'
+                                 r'<script type="math/tex(; mode=display)?">(.*?)</script>\s*</\1>', re.S)
+    MATHJAX_PATTERN = re.compile(r'<script[^>]*\bsrc="[^"]*/MathJax\.js[^"]*"[^>]*>\s*</script>\n?')
+    
+    def __init__(self, site_dir:str, cache_path:str, writer:PageWriter=None, workers:int=None) -> None:
+        self.site_dir = site_dir
+        self.cache_path = cache_path
+        self.writer = writer or PageWriter()
+        self.workers = workers
+        self.counts = defaultdict(int)
+
+
+    def run(self) -> bool:
+        '''Replace formulas of all pages with cached or newly rendered MathML.
+
+        Returns:
+            bool: False if skipped since latex2mathml is not installed.
+        '''
+        if importlib.util.find_spec('latex2mathml') is None:
+            print('latex2mathml is not installed, so math is not pre-rendered.')
+            return False
+        
+        # find all formulas: key -> (tex, display)
+        pages = []
+        for root, _, filenames in os.walk(self.site_dir):
+            pages.extend(os.path.join(root, filename) for filename in filenames if filename.endswith('.html'))
+        formulas = {}
+        for page in pages:
+            with open(page, 'r', encoding='utf-8') as f:
+                for match in MathRenderer.FORMULA_PATTERN.finditer(f.read()):
+                    tex, display = match.group(3).strip(), bool(match.group(2))
+                    formulas[MathRenderer._key(tex, display)] = (tex, display)
+        
+        # render new formulas
+        cache = self._load_cache()
+        todo = [key for key in formulas if key not in cache]
+        if len(todo)>1:
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                rendered = executor.map(MathRenderer._render, *zip(*(formulas[key] for key in todo)), 
+                                        chunksize=max(1, len(todo)//64))
+                cache.update(zip(todo, rendered))
+        else:
+            cache.update((key, MathRenderer._render(*formulas[key])) for key in todo)
+        self.counts['rendered'] = sum(1 for key in todo if cache[key] is not None)
+        self.counts['cached'] = len(formulas) - len(todo)
+        self.counts['failed'] = sum(1 for key in formulas if cache[key] is None)
+
+        # replace formulas, then MathJax if all formulas are rendered
+        for page in pages:
+            with open(page, 'r', encoding='utf-8') as f:
+                text = f.read()
+            failed = False
+            def replace(match):
+                nonlocal failed
+                tex, display = match.group(3).strip(), bool(match.group(2))
+                mathml = cache[MathRenderer._key(tex, display)]
+                if mathml is None:
+                    failed = True
+                    return match.group(0)
+                return f'<{match.group(1)} class="arithmatex">{mathml}</{match.group(1)}>'
+            text = MathRenderer.FORMULA_PATTERN.sub(replace, text)
+            if not failed: text = MathRenderer.MATHJAX_PATTERN.sub('', text)
+            self.writer.write(page, text)
+        
+        with open(self.cache_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(cache, ensure_ascii=False))
+        return True
+
+
+    def summary(self) -> str:
+        return ', '.join(f'{self.counts[k]} {k}' for k in ('rendered', 'cached', 'failed')) + ' formulas; ' + \
+                self.writer.summary()
+
+
+    @staticmethod
+    def _key(tex:str, display:bool) -> str:
+        return hashlib.sha1(f'{int(display)}{tex}'.encode('utf-8')).hexdigest()
+
+
+    @staticmethod
+    def _render(tex:str, display:bool):
+        '''MathML of formula, or None if failed.'''
+        from latex2mathml.converter import convert
+        try:
+            return convert(tex, display='block' if display else 'inline')
+        except Exception:
+            return None
+
+
+    def _load_cache(self) -> dict:
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)), exist_ok=True)
+            return {}
+
+
+
+class SiteAssets:
+    '''Post-build pipeline on the site directory:
+
+    * fingerprint static assets, i.e. ``name.css`` -> ``name.<hash>.css``, and rewrite their
+      references in pages and stylesheets, so they can be served with long cache lifetime; 
+      original files are kept for any reference not rewritten, e.g. from scripts
+    * precompress text files to ``.gz`` siblings, and ``.br`` if ``brotli`` is installed, 
+      in a process pool; compressed files are cached by the hash of source, so a file not 
+      changed since last build is never compressed again, though mkdocs rebuilds all of them
+    '''
+    COMPRESS_EXTENSIONS = ('.html', '.css', '.js', '.json', '.xml', '.svg')
+    FINGERPRINT_EXTENSIONS = ('.css', '.png', '.jpg', '.jpeg', '.gif', '.svg', '.webp')
+    FINGERPRINTED_PATTERN = re.compile(r'\.[0-9a-f]{8}\.\w+$')
+    URL_PATTERN = re.compile(r'''(?:\b(?:href|src)\s*=\s*["']|\burl\(\s*["']?)([^"')\s]+)''')
+    MIN_SIZE = 256 # smaller files are hardly compressed
+    MANIFEST_FILENAME = 'manifest.json'
+
+    def __init__(self, site_dir:str, cache_dir:str, writer:PageWriter=None, workers:int=None) -> None:
+        '''
+        Args:
+            site_dir (str): site directory built by mkdocs.
+            cache_dir (str): directory storing compressed files and the manifest.
+            workers (int): count of processes compressing files, cpu count by default.
+        '''
+        self.site_dir = site_dir
+        self.cache_dir = cache_dir
+        self.writer = writer or PageWriter()
+        self.workers = workers
+        os.makedirs(cache_dir, exist_ok=True)
+
+        # sha1 of source -> {'.gz': True, '.br': False, ...}, False if no gain
+        self._manifest_path = os.path.join(cache_dir, SiteAssets.MANIFEST_FILENAME)
+        try:
+            with open(self._manifest_path, 'r', encoding='utf-8') as f:
+                self._manifest = json.load(f)
+        except (OSError, ValueError):
+            self._manifest = {}
+        
+        self.counts = defaultdict(int)
+
+
+    def run(self, fingerprint:bool=False):
+        files = []
+        for root, _, filenames in os.walk(self.site_dir):
+            files.extend(os.path.relpath(os.path.join(root, filename), self.site_dir).replace(os.sep, '/') \
+                            for filename in filenames if not filename.endswith(('.gz', '.br')))
+        if fingerprint: files.extend(self._fingerprint(files))
+        self._compress_files([rel_path for rel_path in files if rel_path.endswith(SiteAssets.COMPRESS_EXTENSIONS)])
+        
+        with open(self._manifest_path, 'w', encoding='utf-8') as f:
+            json.dump(self._manifest, f)
+
+
+    def summary(self) -> str:
+        return ', '.join(f'{self.counts[k]} {k}' for k in ('fingerprinted', 'compressed', 'cached')) + \
+                f'; {self.counts["bytes"]} -> {self.counts["bytes_gz"]} bytes in gzip.'
+
+
+    def _fingerprint(self, files:list) -> list:
+        '''Link assets to fingerprinted names, and rewrite references in pages and stylesheets.
+        Images are fingerprinted before stylesheets referring to them. Return the new files.
+        '''
+        assets = [rel_path for rel_path in files if rel_path.endswith(SiteAssets.FINGERPRINT_EXTENSIONS) \
+                    and not SiteAssets.FINGERPRINTED_PATTERN.search(rel_path)]
+        names = {}
+        for rel_path in sorted(assets, key=lambda rel_path: rel_path.endswith('.css')):
+            file_path = os.path.join(self.site_dir, rel_path)
+            if rel_path.endswith('.css'): self._rewrite_urls(rel_path, names)
+            with open(file_path, 'rb') as f:
+                digest = hashlib.sha1(f.read()).hexdigest()
+            base, ext = os.path.splitext(rel_path)
+            names[rel_path] = f'{base}.{digest[:8]}{ext}'
+            Images._link(file_path, os.path.join(self.site_dir, names[rel_path]))
+            self.counts['fingerprinted'] += 1
+
+        for rel_path in files:
+            if rel_path.endswith('.html'): self._rewrite_urls(rel_path, names)
+        return list(names.values())
+
+
+    def _rewrite_urls(self, rel_path:str, names:dict):
+        '''Replace relative urls of fingerprinted assets in a page or stylesheet.'''
+        file_path = os.path.join(self.site_dir, rel_path)
+        base_dir = os.path.dirname(rel_path)
+        def replace(match):
+            url = match.group(1)
+            path = re.split(r'[?#]', url)[0]
+            if not path or '://' in path or path.startswith(('//', '/', 'data:')): return match.group(0)
+            target = os.path.normpath(os.path.join(base_dir, unquote(path))).replace(os.sep, '/')
+            if target not in names: return match.group(0)
+            new_url = path[:path.rfind('/')+1] + quote(os.path.basename(names[target])) + url[len(path):]
+            return match.group(0).replace(url, new_url)
+
+        with open(file_path, 'r', encoding='utf-8', errors='surrogateescape') as f:
+            text = f.read()
+        new_text = SiteAssets.URL_PATTERN.sub(replace, text)
+        if new_text!=text: self.writer.write(file_path, new_text)
+
+
+    def _compress_files(self, files:list):
+        '''Link compressed siblings from cache, compressing only files not cached.'''
+        encodings = ['.gz']
+        if importlib.util.find_spec('brotli') is None:
+            print('brotli is not installed, so only gzip files are generated.')
+        else:
+            encodings.append('.br')
+
+        # hash of sources
+        digests = {}
+        for rel_path in files:
+            file_path = os.path.join(self.site_dir, rel_path)
+            if os.path.getsize(file_path)<SiteAssets.MIN_SIZE: continue
+            with open(file_path, 'rb') as f:
+                digests[rel_path] = hashlib.sha1(f.read()).hexdigest()
+
+        # compress sources not cached
+        todo = {}
+        for rel_path, digest in digests.items():
+            record = self._manifest.get(digest, {})
+            if digest in todo or all(ext in record and (not record[ext] or \
+                    os.path.isfile(os.path.join(self.cache_dir, digest+ext))) for ext in encodings): continue
+            todo[digest] = rel_path
+        if todo:
+            args = [(os.path.join(self.site_dir, rel_path), os.path.join(self.cache_dir, digest), encodings) \
+                        for digest, rel_path in todo.items()]
+            with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                for digest, record in zip(todo, executor.map(SiteAssets._compress, *zip(*args), 
+                                                             chunksize=max(1, len(args)//64))):
+                    self._manifest[digest] = record
+        
+        # link compressed siblings, and drop stale ones
+        for rel_path, digest in digests.items():
+            file_path = os.path.join(self.site_dir, rel_path)
+            for ext in encodings:
+                if self._manifest[digest][ext]:
+                    Images._link(os.path.join(self.cache_dir, digest+ext), file_path+ext)
+                elif os.path.exists(file_path+ext):
+                    os.remove(file_path+ext)
+            self.counts['compressed' if digest in todo else 'cached'] += 1
+            self.counts['bytes'] += os.path.getsize(file_path)
+            self.counts['bytes_gz'] += os.path.getsize(file_path+'.gz' if self._manifest[digest]['.gz'] else file_path)
+        
+        # prune cache of files not existing any more
+        for digest in self._manifest.keys() - set(digests.values()):
+            for ext in self._manifest.pop(digest):
+                cache_path = os.path.join(self.cache_dir, digest+ext)
+                if os.path.exists(cache_path): os.remove(cache_path)
+
+
+    @staticmethod
+    def _compress(file_path:str, cache_path:str, encodings:list) -> dict:
+        '''Compress file to ``cache_path`` with each extension of ``encodings``. Return whether 
+        each compressed file is kept, i.e. smaller than source.
+        '''
+        with open(file_path, 'rb') as f:
+            data = f.read()
+        record = {}
+        for ext in encodings:
+            if ext=='.br':
+                import brotli
+                compressed = brotli.compress(data, quality=11)
+            else:
+                compressed = gzip.compress(data, compresslevel=9, mtime=0)
+            record[ext] = len(compressed)<len(data)
+            if record[ext]:
+                with open(cache_path+ext+'.tmp', 'wb') as f:
+                    f.write(compressed)
+                os.replace(cache_path+ext+'.tmp', cache_path+ext)
+        return record
+
+
+
+MANIFEST_FILENAME = '.manifest.json'
+SYNC_MANIFEST_FILENAME = '.sync.json'
+CACHE_DIRNAME = '.cache'
+SEARCH_INDEX_DIRNAME = 'search-index'
+
+
+def sync(src_dir:str, dst_dir:str):
+    '''Synchronize ``src_dir`` to ``dst_dir`` incrementally, which replaces a full copy.
+
+    * Posts are physically copied since they're rewritten in build, while other files, e.g. 
+      images, are hard linked (copied if not supported). Note all generated pages are 
+      written by renaming a temporary file, so the linked source is never modified.
+    * Files not changed since last synchronization are skipped, according to the stat of
+      source files recorded in a manifest next to ``dst_dir``.
+    * Files removed from ``src_dir`` are removed from ``dst_dir`` according to the manifest,
+      rather than wiping the whole directory.
+    '''
+    manifest_path = os.path.join(os.path.dirname(os.path.abspath(dst_dir)), SYNC_MANIFEST_FILENAME)
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            synced = json.load(f)
+    except (OSError, ValueError):
+        synced = {}
+    
+    files, counts = {}, defaultdict(int)
+    for root, _, filenames in os.walk(src_dir):
+        rel_dir = os.path.relpath(root, src_dir)
+        for filename in filenames:
+            rel_path = os.path.normpath(os.path.join(rel_dir, filename))
+            src_path = os.path.join(root, filename)
+            dst_path = os.path.join(dst_dir, rel_path)
+            stat = os.stat(src_path)
+            files[rel_path] = [stat.st_mtime_ns, stat.st_size]
+
+            if synced.get(rel_path)==files[rel_path] and os.path.exists(dst_path):
+                counts['unchanged'] += 1
+                continue
+
+            os.makedirs(os.path.dirname(dst_path), exist_ok=True)
+            if os.path.lexists(dst_path): os.remove(dst_path)
+            if rel_dir=='.' and Post.NAME_PATTERN.match(filename):
+                shutil.copyfile(src_path, dst_path) # new mtime, so to be parsed again
+                counts['copied'] += 1
+                continue
+            try:
+                os.link(src_path, dst_path)
+                counts['linked'] += 1
+            except OSError:
+                shutil.copy2(src_path, dst_path)
+                counts['copied'] += 1
+    
+    # remove stale files
+    for rel_path in synced.keys() - files.keys():
+        dst_path = os.path.join(dst_dir, rel_path)
+        if os.path.lexists(dst_path): 
+            os.remove(dst_path)
+            counts['removed'] += 1
+
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(files, f, ensure_ascii=False)
+
+    print(', '.join(f'{counts[k]} {k}' for k in ('copied', 'linked', 'unchanged', 'removed')) + '.')
 
 
 def run(cfg_file_path:str,
         archive_path_name:str='archives', 
         category_path_name:str='categories', 
         latest_posts_count:int=5,
-        update_page:bool=False):
-    
-    # collect all posts
+        update_page:bool=False,
+        workers:int=0,
+        use_process:bool=False,
+        search_index:bool=False,
+        page_size:int=0,
+        nav_limit:int=0,
+        report_path:str=None,
+        profile_path:str=None,
+        related_count:int=0,
+        links_report_path:str=None,
+        feed_count:int=0,
+        sitemap:bool=False):
+    '''Summarize posts and update navigation. Statistics of each phase is saved to 
+    ``report_path`` as JSON, and the whole build is profiled to ``profile_path`` if specified.
+    Links to ``related_count`` related posts are appended to each post when updating pages.
+    Internal links of posts are checked and reported to ``links_report_path`` if specified.
+    Atom feed of ``feed_count`` latest posts and sitemap are generated if required, which 
+    needs ``site_url`` in config file.
+    '''
+    writer = PageWriter()
+    report = BuildReport(writer, profile_path=profile_path)
+
+    # collect all posts: only changed posts are parsed
     build_dir = os.path.dirname(cfg_file_path)
     docs_dir = os.path.join(build_dir, 'docs')
-    posts = Posts(docs_dir, category_path_name, archive_path_name)
+    with report.phase('collect'):
+        manifest = Manifest(os.path.join(build_dir, MANIFEST_FILENAME))
+        posts = Posts(docs_dir, category_path_name, archive_path_name, manifest, workers, use_process, writer,
+                      page_size, nav_limit, report)
     
     # summary pages by category and year
-    posts.to_category_pages()
-    posts.to_archive_pages()
+    with report.phase('category_pages'):
+        posts.to_category_pages()
+    with report.phase('archive_pages'):
+        posts.to_archive_pages()
 
     # update config file
-    cfg = ConfigFile(cfg_file_path)
-    cfg.update(posts.to_navigation())
+    with report.phase('config'):
+        cfg = ConfigFile(cfg_file_path)
+        cfg.update(posts.to_navigation(), writer)
+        use_directory_urls = cfg.get_value('use_directory_urls', 'true').lower()!='false'
     
-    # create index page only if not exist
-    if not os.path.exists(os.path.join(docs_dir, Posts.INDEX_FILENAME)):
-        title = cfg.get_site_info()
-        posts.to_home_page(title, latest_posts_count)
+    # create index page only if not exist, or it's created by this script
+    with report.phase('home_page'):
+        index_path = os.path.join(docs_dir, Posts.INDEX_FILENAME)
+        if not os.path.exists(index_path) or posts.is_generated_page(index_path):
+            title = cfg.get_site_info()
+            posts.to_home_page(title, latest_posts_count)
     
+    # offline search index, before meta-data is included
+    if search_index:
+        with report.phase('search_index'):
+            index = SearchIndex(os.path.join(docs_dir, SEARCH_INDEX_DIRNAME), 
+                                os.path.join(build_dir, CACHE_DIRNAME, 'search.json'), writer, 
+                                use_directory_urls=use_directory_urls)
+            index.update(posts.iter_posts())
+            report.read(index.bytes_read, index.files_read)
+
     # include meta-data to page
     if update_page: 
-        posts.to_meta_pages()
+        related = None
+        if related_count>0:
+            with report.phase('related_posts'):
+                related = RelatedPosts(os.path.join(build_dir, CACHE_DIRNAME, 'related.json'), related_count)
+                related.update(posts.iter_posts())
+                report.read(related.bytes_read, related.files_read)
+        with report.phase('meta_pages'):
+            posts.to_meta_pages(related)
+    
+    # feed and sitemap, after posts are rewritten
+    if feed_count>0 or sitemap:
+        with report.phase('feed'):
+            site_url = cfg.get_value('site_url')
+            if not site_url:
+                print('site_url is not set, so feed and sitemap are not generated.')
+            if site_url and feed_count>0:
+                posts.to_feed(site_url, cfg.get_value('site_name', 'My Blog'), cfg.get_value('site_description', ''), 
+                              feed_count, use_directory_urls, cfg.get_value('site_author', ''))
+            if site_url and sitemap:
+                posts.to_sitemap(site_url, use_directory_urls)
+
+    # check links after all pages are generated
+    if links_report_path:
+        with report.phase('check_links'):
+            checker = LinkChecker(docs_dir, os.path.join(build_dir, CACHE_DIRNAME, 'links.json'), 
+                                  cfg.get_toc_separator(), workers or None)
+            checker.run(posts.iter_posts())
+            checker.save(links_report_path)
+            report.read(checker.bytes_read, checker.extracted)
+        print(checker.summary())
+    
+    with report.phase('manifest'):
+        manifest.save()
+    
+    report.finish()
+    if report_path: report.save(report_path)
+    print(writer.summary())
+
+
+def watch(cfg_file_path:str,
+        archive_path_name:str='archives', 
+        category_path_name:str='categories', 
+        latest_posts_count:int=5,
+        interval:float=1.0,
+        page_size:int=0,
+        nav_limit:int=0):
+    '''Keep posts in memory, and update affected summary pages, home page and navigation 
+    once any post is created, modified, moved or deleted.
+    '''
+    build_dir = os.path.dirname(cfg_file_path)
+    docs_dir = os.path.join(build_dir, 'docs')
+    manifest = Manifest(os.path.join(build_dir, MANIFEST_FILENAME))
+    writer = PageWriter()
+    posts = Posts(docs_dir, category_path_name, archive_path_name, manifest, writer=writer, 
+                  page_size=page_size, nav_limit=nav_limit)
+    cfg = ConfigFile(cfg_file_path)
+    index_path = os.path.join(docs_dir, Posts.INDEX_FILENAME)
+
+    watcher = Watcher(docs_dir, interval)
+    print(f'Watching {docs_dir} ({watcher.mode})...')
+    try:
+        for filenames in watcher:
+            years, categories = posts.refresh(filenames)
+            if not years and not categories: continue
+            
+            written = writer.written
+            posts.to_category_pages(categories)
+            posts.to_archive_pages(years)
+            cfg.update(posts.to_navigation(), writer)
+            if not os.path.exists(index_path) or posts.is_generated_page(index_path):
+                posts.to_home_page(cfg.get_site_info(), latest_posts_count)
+            manifest.save()
+            print(f'{", ".join(sorted(filenames))}: {writer.written-written} pages updated.')
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()
     
     
 
 
 if __name__=='__main__':
-    import sys
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Summarize posts by category and year.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    # summarize posts
+    summary = argparse.ArgumentParser(add_help=False)
+    summary.add_argument('cfg_file')
+    summary.add_argument('archive_name')
+    summary.add_argument('categories_name')
+    summary.add_argument('latest_count', type=int)
+    summary.add_argument('--workers', type=int, default=0, help='count of workers parsing posts in parallel')
+    summary.add_argument('--process', action='store_true', help='parse posts with process pool instead of threads')
+    summary.add_argument('--interval', type=float, default=1.0, help='seconds between scans if inotify is unavailable')
+    summary.add_argument('--search', action='store_true', help='generate offline search index')
+    summary.add_argument('--page-size', type=int, default=0, help='posts per summary page, no pagination if 0')
+    summary.add_argument('--nav-limit', type=int, default=0, help='categories listed in navigation, all if 0')
+    summary.add_argument('--report', help='save statistics of each phase to this JSON file')
+    summary.add_argument('--profile', help='save cProfile stats of the build to this file')
+    summary.add_argument('--related', type=int, default=0, help='count of related posts appended to each post in build')
+    summary.add_argument('--check-links', help='check internal links and save broken ones to this JSON file')
+    summary.add_argument('--feed', type=int, default=0, help='count of latest posts in Atom feed, no feed if 0')
+    summary.add_argument('--sitemap', action='store_true', help='generate sitemap of posts and summary pages')
+    for command in ('serve', 'build', 'watch'):
+        commands.add_parser(command, parents=[summary])
+
+    # synchronize docs to build directory
+    parser_sync = commands.add_parser('sync')
+    parser_sync.add_argument('src_dir')
+    parser_sync.add_argument('dst_dir')
+
+    # pre-render math of built site
+    parser_math = commands.add_parser('math')
+    parser_math.add_argument('site_dir')
+    parser_math.add_argument('--cache-dir', help='directory of cached formulas, build/.cache by default')
+    parser_math.add_argument('--workers', type=int, default=None, help='count of processes rendering formulas')
+
+    # precompress and fingerprint assets of built site
+    parser_assets = commands.add_parser('assets')
+    parser_assets.add_argument('site_dir')
+    parser_assets.add_argument('--cache-dir', help='directory of compressed files, build/.cache/assets by default')
+    parser_assets.add_argument('--workers', type=int, default=None, help='count of processes compressing files')
+    parser_assets.add_argument('--fingerprint', action='store_true', help='link static assets to content-hashed names')
+
+    # image assets in build directory
+    parser_images = commands.add_parser('images')
+    parser_images.add_argument('docs_dir')
+    parser_images.add_argument('--cache-dir', help='directory of cached variants, build/.cache/images by default')
+    parser_images.add_argument('--max-width', type=int, default=1200, help='downscale images wider than it')
+    parser_images.add_argument('--quality', type=int, default=85, help='quality of recompressed JPEG images')
+    parser_images.add_argument('--workers', type=int, default=None, help='count of processes generating variants')
+    parser_images.add_argument('--no-prune', action='store_true', help='keep images not referenced by any page')
+    
+    args = parser.parse_args()
 
-    command, cfg_file, archive_name, categories_name, latest_count = sys.argv[1:]
-    latest_count = int(latest_count)
-    run(cfg_file, archive_name, categories_name, latest_count, command=='build')
\ No newline at end of file
+    if args.command=='sync':
+        sync(args.src_dir, args.dst_dir)
+    elif args.command=='math':
+        cache_dir = args.cache_dir or os.path.join(os.path.dirname(os.path.abspath(args.site_dir)), CACHE_DIRNAME)
+        renderer = MathRenderer(args.site_dir, os.path.join(cache_dir, 'math.json'), workers=args.workers)
+        if renderer.run(): print(renderer.summary())
+    elif args.command=='assets':
+        cache_dir = args.cache_dir or os.path.join(os.path.dirname(os.path.abspath(args.site_dir)), CACHE_DIRNAME, 'assets')
+        assets = SiteAssets(args.site_dir, cache_dir, workers=args.workers)
+        assets.run(args.fingerprint)
+        print(assets.summary())
+    elif args.command=='images':
+        cache_dir = args.cache_dir or os.path.join(os.path.dirname(os.path.abspath(args.docs_dir)), CACHE_DIRNAME, 'images')
+        images = Images(args.docs_dir, cache_dir, max_width=args.max_width, quality=args.quality, workers=args.workers)
+        images.run(prune=not args.no_prune)
+        print(images.summary())
+    elif args.command=='watch':
+        watch(args.cfg_file, args.archive_name, args.categories_name, args.latest_count, args.interval,
+              args.page_size, args.nav_limit)
+    else:
+        run(args.cfg_file, args.archive_name, args.categories_name, args.latest_count, args.command=='build',
+            args.workers, args.process, args.search, args.page_size, args.nav_limit, args.report, args.profile, 
+            args.related, args.check_links, args.feed, args.sitemap)
\ No newline at end of file
@@ -1,6 +1,9 @@
 '''
 General process solving Ordinary Differential Equations, with solver like
-forward Euler, Runge Kutta method. The step size is determined adaptively.
+forward Euler, Runge Kutta method. The step size is determined adaptively, either
+by step doubling, or by the error estimated with an embedded Runge Kutta pair, e.g. 
+Dormand-Prince 5(4). Stiff ODEs are solved by the implicit Rosenbrock 2(3) method,
+optionally switched to automatically once stiffness is detected.
 
 Combining ODEs:
     y1'=f1(x, y1, y2, ...yn)
@@ -19,8 +22,44 @@ where:
 
 import numpy as np
 
-
-def ode(F, span, Y0, solver=None, err=1e-6):
+try:
+    from scipy.linalg import lu_factor, lu_solve
+except ImportError:
+    lu_factor = lu_solve = None
+
+
+# Butcher tableau of Dormand-Prince 5(4) pair: nodes, stage coefficients, and the
+# difference between weights of the 5th and 4th order solutions. Weights of the 5th
+# order solution equal the last stage, so the last derivative is the first one of the
+# next step (FSAL).
+DP_C = [0, 1/5, 3/10, 4/5, 8/9, 1, 1]
+DP_A = [
+    [],
+    [1/5],
+    [3/40, 9/40],
+    [44/45, -56/15, 32/9],
+    [19372/6561, -25360/2187, 64448/6561, -212/729],
+    [9017/3168, -355/33, 46732/5247, 49/176, -5103/18656],
+    [35/384, 0, 500/1113, 125/192, -2187/6784, 11/84]
+]
+DP_E = [71/57600, 0, -71/16695, 71/1920, -17253/339200, 22/525, -1/40]
+
+# coefficients of the 4 order continuous extension of Dormand-Prince 5(4) pair: the
+# interpolant in step [x0, x0+h] is Y0 + h*sum(Q[k]*theta^(k+1)), theta=(x-x0)/h,
+# where Q[k] = sum(DP_P[s][k]*K[s]) for each stage s
+DP_P = [
+    [1, -8048581381/2820520608, 8663915743/2820520608, -12715105075/11282082432],
+    [0, 0, 0, 0],
+    [0, 131558114200/32700410799, -68118460800/10900136933, 87487479700/32700410799],
+    [0, -1754552775/470086768, 14199869525/1410260304, -10690763975/1880347072],
+    [0, 127303824393/49829197408, -318862633887/49829197408, 701980252875/199316789632],
+    [0, -282668133/205662961, 2019193451/616988883, -1453857185/822651844],
+    [0, 40617522/29380423, -110615467/29380423, 69997945/29380423]
+]
+
+
+def ode(F, span, Y0, solver=None, err=1e-6, rtol=0.0, batch=False, shared_step=True, t_eval=None, 
+        dense=False, memmap=None, auto_switch=False):
     '''
         General process solving ODEs Y'=F(x, Y) with adaptive step size.
 
@@ -28,32 +67,60 @@ def ode(F, span, Y0, solver=None, err=1e-6):
         range `span` should be split and solved separately, finally combine them together. Sample
         codes for c1 <= t0 <= c2:
 
-            left = ode(F, [t0, c1], Y0, solver, err) # solving in a reversing direction, i.e. step size < 0
-            right = ode(F, [t0, c2], Y0, solver, err)
-            res = left[::-1] + right[1:]
+            X1, Y1 = ode(F, [t0, c1], Y0, solver, err) # solving in a reversing direction, i.e. step size < 0
+            X2, Y2 = ode(F, [t0, c2], Y0, solver, err)
+            X, Y = np.concatenate([X1[::-1], X2[1:]]), np.concatenate([Y1[::-1], Y2[1:]])
 
         Arguments:
             F      : derivative function F(x, Y)
             span   : interval [x_start, x_end]
             Y0     : initial Y0 at x0=span[0] (can be a vector)
-            err    : adaptive steps defined by numeric precision
-            solver : solver function, e.g. Euler-forward, Runge-Kutta
+            err    : adaptive steps defined by numeric precision; absolute tolerance of each 
+                     component (scalar or vector) for embedded solvers
+            solver : solver function, e.g. Euler-forward, Runge-Kutta, or embedded pair 
+                     like Dormand_Prince45; Rosenbrock23 (class or instance) for stiff ODEs
+            rtol   : relative tolerance of each component for embedded solvers
+            batch  : Y0 is a batch of M initial values in shape (M, n), solved at once with
+                     F evaluated on the whole batch; see ode_batch()
+            shared_step: all trajectories of a batch go with the same step size if True, 
+                     otherwise each one with its own step size
+            t_eval : points in span, ordered in the direction of solving, where solution is
+                     sampled from the interpolant of each step rather than the steps
+            dense  : return continuous solution, i.e. function Y(x) for any x in span
+            memmap : file path backing Y with numpy.memmap, for very long integrations
+            auto_switch: start with explicit Dormand_Prince45, and switch to implicit
+                     Rosenbrock23 once the ODEs are detected to be stiff
 
         returns:
-            A list of points:
-                [(x_start,Y0), (x1,Y1), (x2,Y2),..., (x_end,Yn)]
+            Arrays of points (X, Y):
+                X = [x_start, x1, x2, ..., x_end]
+                Y = [Y0, Y1, Y2, ..., Yn]
+            where x1, x2, ... are points of t_eval if specified, and Y is stacked along the
+            first axis; arrays of a batch, see ode_batch(); or function Y(x) if dense
     '''
+    # dense output is provided by embedded solvers; stateful solvers are given by class
+    if solver==None and (batch or dense or auto_switch or t_eval is not None): solver = Dormand_Prince45
+    if isinstance(solver, type): solver = solver()
+    if (dense or t_eval is not None) and not hasattr(solver, 'dense'):
+        raise ValueError('Dense output needs a solver with interpolant, e.g. Dormand_Prince45.')
+
+    if batch: 
+        return ode_batch(F, span, Y0, solver, err, rtol, shared_step, t_eval=t_eval, dense=dense, memmap=memmap, 
+                         auto_switch=auto_switch)
 
     if solver==None: solver = Runge_Kutta4
+    if getattr(solver, 'embedded', False): 
+        return ode_embedded(F, span, Y0, solver, err, rtol, t_eval=t_eval, dense=dense, memmap=memmap, 
+                            auto_switch=auto_switch)
 
-    res = []
+    res = ResultArrays(np.shape(Y0), memmap=memmap)
     x0, P0 = span[0], (span[0], Y0)
-    res.append(P0)
+    res.append(*P0)
 
     # if low bound is equal to upper bound, return itself
     h_max = span[1]-span[0] # initial step
     if h_max==0:
-        return res    
+        return res.arrays()
 
     h = h_max
     while True:
@@ -64,15 +131,435 @@ def ode(F, span, Y0, solver=None, err=1e-6):
         if exceed: break
 
         P1 = solver(F, P0, h)
-        res.append(P1)
+        res.append(*P1)
         P0 = P1 # preparation for next loop
 
     # close last point
     if P0[0]<span[1]:
         P1 = solver(F, P0, span[1]-P0[0])
-        res.append(P1)
+        res.append(*P1)
+
+    return res.arrays()
+
+
+def ode_embedded(F, span, Y0, solver, atol, rtol, safety=0.9, beta=0.04, t_eval=None, dense=False, 
+                 memmap=None, auto_switch=False):
+    '''
+        Solving ODEs with an embedded pair, where step size is controlled by the error 
+        estimated from the difference between the two solutions, and each step needs 
+        only one more evaluation of F for 5 order solver with FSAL.
+
+        A step is accepted if the scaled RMS error:
+
+            err = sqrt(mean((E / (atol + rtol*max(|Y0|, |Y1|)))^2))
+
+        is not greater than 1, where the mean is taken over the last axis of Y and the 
+        maximum one is used if Y is a batch, then next step is given by a PI controller:
+
+            h1 = h * safety * err^-(1/order - 0.75*beta) * err_prev^beta
+
+        For implicit solvers, the step is kept if it would grow less than 20%, so that
+        the factorized iteration matrix is reused.
+
+        Stiffness is detected by explicit solvers providing an estimate of h*|lambda|, 
+        i.e. the step size times the dominant eigenvalue of Jacobian, see Hairer's Solving 
+        Ordinary Differential Equations II, Section IV.2: the ODEs are stiff once the step 
+        is limited by stability rather than accuracy, i.e. the estimate exceeds the 
+        stability boundary in 15 accepted steps, without 6 non-stiff steps in a row.
+
+        Arguments:
+            F     : derivative function F(x, Y)
+            span  : interval [x_start, x_end]
+            Y0    : initial Y0 at x0=span[0]
+            solver: embedded solver, e.g. Dormand_Prince45, or implicit Rosenbrock23
+            atol  : absolute tolerance, scalar or vector
+            rtol  : relative tolerance, scalar or vector
+            safety: safety factor of new step
+            beta  : coefficient of previous error in PI controller
+            t_eval: sample solution at these points with the interpolant of each step,
+                    which doesn't affect step size
+            dense : return continuous solution rather than points
+            memmap: file path backing Y with numpy.memmap
+            auto_switch: switch to Rosenbrock23 once stiffness is detected
 
-    return res
+        returns:
+            Arrays of points (X, Y) like ode(), or function Y(x) if dense
+    '''
+    x0, x_end = span
+    Y0 = np.asarray(Y0, dtype=float)
+    direction = 1 if x_end>=x0 else -1
+
+    # points where solution is sampled, whose count is known, and steps of continuous solution
+    if t_eval is None:
+        res = ResultArrays(Y0.shape, memmap=memmap)
+        res.append(x0, Y0)
+    else:
+        t_eval = check_t_eval(t_eval, span)
+        res = ResultArrays(Y0.shape, len(t_eval), memmap=memmap)
+        k = np.searchsorted(direction*t_eval, direction*x0, side='right')
+        res.extend(t_eval[:k], np.broadcast_to(Y0, (k,)+Y0.shape))
+    nodes, values, coefficients = [x0], [Y0], []
+
+    if x_end==x0: return dense_solution(nodes, values, coefficients) if dense else res.arrays()
+
+    alpha = 1.0/solver.order - 0.75*beta
+    axis = -1 if Y0.ndim else None
+    K1 = F(x0, Y0)
+    h = float(initial_step(F, (x0, Y0), K1, direction, solver.order, atol, rtol))
+    err_prev = 1e-4
+    stiff_steps = non_stiff_steps = 0
+
+    while direction*(x_end-x0)>0:
+        # last step ends exactly at x_end
+        last = direction*(x0+h-x_end)>=0
+        if last: h = x_end-x0
+        if abs(h)<=16*np.finfo(float).eps*max(abs(x0), abs(x_end)):
+            raise RuntimeError(f'Step size is too small at x={x0}.')
+
+        (x1, Y1), E, K = solver(F, (x0, Y0), h, K1)
+        scale = atol + rtol*np.maximum(abs(Y0), abs(Y1))
+        err = max(np.max(np.sqrt(np.mean((E/scale)**2, axis=axis))), 1e-10)
+
+        if err>1:
+            # reject and retry with a smaller step
+            h *= max(0.2, safety*err**-alpha)
+            continue
+
+        # accept, then the next step is predicted by current and previous error
+        x1 = x_end if last else x1
+        if dense or t_eval is not None:
+            Q = solver.dense(K)
+            if dense: 
+                nodes.append(x1)
+                values.append(Y1)
+                coefficients.append(Q)
+            if t_eval is not None:
+                k1 = np.searchsorted(direction*t_eval, direction*x1, side='right')
+                res.extend(t_eval[k:k1], interpolate(t_eval[k:k1], (x0, Y0), x1-x0, Q))
+                k = k1
+        else:
+            res.append(x1, Y1)
+
+        # switch to implicit solver once stiff
+        if auto_switch and hasattr(solver, 'stiffness'):
+            if solver.stiffness(K, x1-x0)>solver.stability:
+                stiff_steps, non_stiff_steps = stiff_steps+1, 0
+            else:
+                non_stiff_steps += 1
+                if non_stiff_steps==6: stiff_steps = 0
+            if stiff_steps==15:
+                solver = Rosenbrock23()
+                alpha = 1.0/solver.order - 0.75*beta
+
+        factor = min(10.0, max(0.2, safety * err**-alpha * err_prev**beta))
+        if getattr(solver, 'implicit', False) and 1.0<=factor<=1.2: factor = 1.0
+        h *= factor
+        err_prev = err
+        x0, Y0, K1 = x1, Y1, K[-1]
+
+    return dense_solution(nodes, values, coefficients) if dense else res.arrays()
+
+
+def ode_batch(F, span, Y0, solver, atol, rtol, shared_step=True, safety=0.9, beta=0.04, t_eval=None, 
+              dense=False, memmap=None, auto_switch=False):
+    '''
+        Solving ODEs for a batch of initial values at once, with an embedded pair. F is
+        evaluated on the whole batch, so each step costs a few numpy calls no matter how 
+        many trajectories there are.
+
+        * Shared step: F(x, Y) is called with scalar x and Y in shape (M, n), and the step
+          size meets the tolerance of all trajectories, see ode_embedded().
+        * Per-trajectory step: each trajectory goes with its own step size, so F(x, Y) is 
+          called with x in shape (m, 1), i.e. broadcast against Y in shape (m, n), where m
+          is the count of trajectories not finished yet.
+
+        Arguments:
+            F     : derivative function F(x, Y) on a batch
+            span  : interval [x_start, x_end]
+            Y0    : initial values in shape (M, n)
+            solver: embedded solver, e.g. Dormand_Prince45
+            atol  : absolute tolerance, scalar or vector of n components
+            rtol  : relative tolerance, scalar or vector of n components
+            shared_step: all trajectories go with the same step size if True
+            t_eval: sample all trajectories at these points, see ode_embedded()
+            dense : return continuous solution of the batch, for shared step only
+            memmap: file path backing the result Y with numpy.memmap; points of per-trajectory 
+                    steps are stored there directly, so Y is never held in memory
+            auto_switch: switch to Rosenbrock23 once stiffness is detected, for shared step
+                    only, where the batch is solved as one system by implicit solver
+
+        returns:
+            Stacked arrays (X, Y), where Y is in shape (N, M, n) and X is in shape (N,) 
+            for shared step or t_eval, otherwise (N, M) for per-trajectory step, in which 
+            case shorter trajectories are padded with their last point. Function Y(x) if
+            dense.
+    '''
+    if not getattr(solver, 'embedded', False):
+        raise ValueError('Batched integration needs an embedded solver, e.g. Dormand_Prince45.')
+    
+    if shared_step:
+        return ode_embedded(F, span, Y0, solver, atol, rtol, safety, beta, t_eval, dense, memmap, auto_switch)
+    if dense:
+        raise ValueError('Continuous solution of batch needs shared step, or sample it with t_eval.')
+    if auto_switch or getattr(solver, 'implicit', False):
+        raise ValueError('Implicit solver works on batch with shared step only.')
+
+    x0, x_end = span
+    Y = np.array(Y0, dtype=float)
+    M = Y.shape[0]
+    x = np.full((M, 1), x0, dtype=float)
+    direction = 1 if x_end>=x0 else -1
+    if t_eval is None:
+        # accepted points are stored at own rows of each trajectory, i.e. counts of points
+        res = ResultArrays(Y.shape, memmap=memmap, x_shape=(M,))
+        counts = np.zeros(M, dtype=int)
+        res.put(counts, np.arange(M), x[:, 0], Y)
+        counts += 1
+    else:
+        # points sampled by each trajectory so far
+        t_eval = check_t_eval(t_eval, span)
+        Y_eval = ResultArrays(Y.shape, len(t_eval), memmap=memmap).Y
+        k = np.searchsorted(direction*t_eval, direction*x0, side='right')
+        Y_eval[:k] = Y
+        sampled = np.full(M, k)
+
+    if x_end!=x0:
+        alpha = 1.0/solver.order - 0.75*beta
+        K1 = F(x, Y)
+        h = initial_step(F, (x, Y), K1, direction, solver.order, atol, rtol, axis=-1)
+        err_prev = np.full((M, 1), 1e-4)
+        active = np.ones(M, dtype=bool)
+
+    while x_end!=x0 and active.any():
+        # step of trajectories not finished, where last steps end exactly at x_end
+        i = np.flatnonzero(active)
+        x0_i, h_i = x[i], h[i]
+        last = direction*(x0_i+h_i-x_end)>=0
+        h_i = np.where(last, x_end-x0_i, h_i)
+        too_small = abs(h_i)<=16*np.finfo(float).eps*max(abs(x0), abs(x_end))
+        if too_small.any():
+            raise RuntimeError(f'Step size is too small at x={x0_i[too_small][0]}.')
+
+        (x1, Y1), E, K = solver(F, (x0_i, Y[i]), h_i, K1[i])
+        scale = atol + rtol*np.maximum(abs(Y[i]), abs(Y1))
+        err = np.maximum(np.sqrt(np.mean((E/scale)**2, axis=-1, keepdims=True)), 1e-10)
+
+        # rejected ones retry with smaller steps, while accepted ones move on
+        ok = err<=1
+        h[i] = h_i * np.where(ok, np.clip(safety * err**-alpha * err_prev[i]**beta, 0.2, 10.0), 
+                                  np.maximum(0.2, safety*err**-alpha))
+        ok, j = ok[:, 0], i[ok[:, 0]]
+        x[j] = np.where(last[ok], x_end, x1[ok])
+
+        # sample accepted steps at points of t_eval passed, one point per trajectory a time
+        if t_eval is not None and j.size:
+            Q = solver.dense(K)[:, ok]
+            k1 = np.searchsorted(direction*t_eval, direction*x[j, 0], side='right')
+            for r in range((k1-sampled[j]).max()):
+                n = sampled[j]+r < k1 # trajectories with more points in this step
+                points = sampled[j[n]]+r
+                H = (x[j[n]]-x0_i[ok][n])
+                theta = (t_eval[points][:, None]-x0_i[ok][n]) / H
+                powers = theta**np.arange(1, Q.shape[0]+1) # (m, k)
+                Y_eval[points, j[n]] = Y[j[n]] + H*np.einsum('mk,km...->m...', powers, Q[:, n])
+            sampled[j] = k1
+
+        Y[j], K1[j], err_prev[j] = Y1[ok], K[-1][ok], err[ok]
+        active[j[last[ok, 0]]] = False
+
+        if t_eval is None and j.size:
+            res.put(counts[j], j, x[j, 0], Y[j])
+            counts[j] += 1
+
+    if t_eval is not None:
+        if memmap: Y_eval.flush()
+        return t_eval, Y_eval
+
+    # pad shorter trajectories with their last point
+    X_out, Y_out = res.arrays()
+    pad = np.arange(len(X_out))[:, None]>=counts
+    X_out[pad] = np.broadcast_to(x[:, 0], X_out.shape)[pad]
+    Y_out[pad] = np.broadcast_to(Y, Y_out.shape)[pad]
+    if memmap: Y_out.flush()
+
+    return X_out, Y_out
+
+
+class ResultArrays:
+    '''
+        Points of solution stored in preallocated arrays X and Y, which grow geometrically
+        once full, so appending a point allocates nothing in most cases. Y can be backed by
+        a memory-mapped file for very long integrations.
+
+        Arguments:
+            shape   : shape of Y at each point
+            capacity: count of points preallocated
+            memmap  : file path backing Y with numpy.memmap, in memory if None
+            x_shape : shape of x at each point, e.g. (M,) for a batch with own steps
+    '''
+
+    def __init__(self, shape=(), capacity=64, memmap=None, x_shape=()):
+        self.shape = tuple(shape)
+        self.memmap = memmap
+        self.size = 0
+        self.X = np.empty((capacity,)+tuple(x_shape))
+        if memmap:
+            self.Y = np.memmap(memmap, dtype=float, mode='w+', shape=(capacity,)+self.shape)
+        else:
+            self.Y = np.empty((capacity,)+self.shape)
+
+
+    def append(self, x, Y):
+        if self.size==len(self.X): self._resize(2*len(self.X))
+        self.X[self.size] = x
+        self.Y[self.size] = Y
+        self.size += 1
+
+
+    def extend(self, X, Y):
+        n = len(X)
+        if self.size+n>len(self.X): self._resize(max(2*len(self.X), self.size+n))
+        self.X[self.size:self.size+n] = X
+        self.Y[self.size:self.size+n] = Y
+        self.size += n
+
+
+    def put(self, rows, columns, x, Y):
+        '''Store points of a batch with own steps, where trajectories ``columns`` are at their
+        own ``rows``, i.e. count of points so far.'''
+        size = rows.max()+1
+        if size>len(self.X): self._resize(max(2*len(self.X), size))
+        self.X[rows, columns] = x
+        self.Y[rows, columns] = Y
+        self.size = max(self.size, size)
+
+
+    def arrays(self):
+        '''Arrays (X, Y) trimmed to the points stored.'''
+        if self.size<len(self.X): self._resize(self.size)
+        if self.memmap: self.Y.flush()
+        return self.X, self.Y
+
+
+    def _resize(self, capacity):
+        # arrays are owned here and never viewed until returned, so resized in place
+        self.X.resize((capacity,)+self.X.shape[1:], refcheck=False)
+        if not self.memmap:
+            self.Y.resize((capacity,)+self.shape, refcheck=False)
+            return
+
+        # resize the file and map it again
+        self.Y.flush()
+        self.Y = None
+        with open(self.memmap, 'r+b') as f:
+            f.truncate(capacity*int(np.prod(self.shape))*np.dtype(float).itemsize)
+        self.Y = np.memmap(self.memmap, dtype=float, mode='r+', shape=(capacity,)+self.shape)
+
+
+def check_t_eval(t_eval, span):
+    '''Points to sample solution as an array, which must be in span and ordered in the
+    direction of solving.'''
+    t_eval = np.asarray(t_eval, dtype=float).reshape(-1)
+    x0, x_end = span
+    direction = 1 if x_end>=x0 else -1
+    if np.any(direction*(t_eval-x0)<0) or np.any(direction*(t_eval-x_end)>0):
+        raise ValueError('Points of t_eval must be in span.')
+    if np.any(direction*np.diff(t_eval)<0):
+        raise ValueError('Points of t_eval must be ordered in the direction of solving.')
+    return t_eval
+
+
+def interpolate(x, P0, h, Q):
+    '''
+        Values of the interpolant of step [x0, x0+h]:
+
+            Y(x) = Y0 + h*sum(Q[k]*theta^(k+1)), theta=(x-x0)/h
+
+        Arguments:
+            x : points in the step, scalar or vector
+            P0: start point of step (x0, Y0)
+            h : step size
+            Q : coefficients of interpolant given by solver, e.g. Dormand_Prince45_dense()
+
+        Return:
+            values at x, stacked along the first axis if x is a vector
+    '''
+    x0, Y0 = P0
+    theta = (np.asarray(x, dtype=float)-x0) / h
+    powers = theta[..., None]**np.arange(1, len(Q)+1)
+    return Y0 + h*np.tensordot(powers, Q, axes=1)
+
+
+def dense_solution(X, Y, Q):
+    '''
+        Continuous solution composed of the interpolant of each step.
+
+        Arguments:
+            X: nodes of steps [x0, x1, ..., xn]
+            Y: values at nodes [Y0, Y1, ..., Yn]
+            Q: coefficients of interpolant of each step [Q1, ..., Qn]
+
+        Return:
+            function Y(x), where x is scalar or vector and values are stacked along the 
+            first axis for vector
+    '''
+    X, Y = np.asarray(X, dtype=float), np.stack(Y)
+    if Q: # interpolants of different degrees if solver is switched
+        k = max(len(q) for q in Q)
+        Q = np.stack([np.concatenate([q, np.zeros((k-len(q),)+q.shape[1:])]) if len(q)<k else q for q in Q])
+    else:
+        Q = None
+    direction = 1 if X[-1]>=X[0] else -1
+
+    def solution(x):
+        x = np.asarray(x, dtype=float)
+        if Q is None: return np.broadcast_to(Y[0], x.shape+Y.shape[1:]).copy()
+
+        # step of each point: x in [X[i], X[i+1]]
+        i = np.clip(np.searchsorted(direction*X, direction*x, side='right')-1, 0, len(Q)-1)
+        h = X[i+1]-X[i]
+        theta = (x-X[i]) / h
+        shape = x.shape + (1,)*(Y.ndim-1) # broadcast against values
+        powers = (theta[..., None]**np.arange(1, Q.shape[1]+1)).reshape(shape+(-1,))
+        dY = np.sum(np.moveaxis(Q[i], x.ndim, -1)*powers, axis=-1)
+        return Y[i] + h.reshape(shape)*dY
+
+    return solution
+
+
+def initial_step(F, P0, K1, direction, order, atol, rtol, axis=None):
+    '''
+        Estimate initial step size from derivatives at initial point, see Hairer's
+        Solving Ordinary Differential Equations I, Section II.4.
+
+        Arguments:
+            F        : derivative function F(x, Y)
+            P0       : initial point (x0, Y0)
+            K1       : F(x0, Y0)
+            direction: 1 if solving forward, otherwise -1
+            order    : order of solver
+            axis     : estimate step size of each row along this axis, e.g. -1 for a
+                       batch of trajectories, otherwise one step size for all
+
+        Return:
+            signed step size
+    '''
+    x0, Y0 = P0
+    scale = atol + rtol*abs(Y0)
+    norm = lambda Y: np.sqrt(np.mean((Y/scale)**2, axis=axis, keepdims=axis is not None))
+    tiny = 1e-300 # avoid dividing by zero, though the result is not taken then
+
+    # explicit Euler step
+    d0, d1 = norm(Y0), norm(K1)
+    h0 = np.where((d0<1e-5) | (d1<1e-5), 1e-6, 0.01*d0/np.maximum(d1, tiny))
+    K2 = F(x0+direction*h0, Y0+direction*h0*K1)
+
+    # estimate of second derivative
+    d2 = norm(K2-K1) / h0
+    d = np.maximum(d1, d2)
+    h1 = np.where(d<=1e-15, np.maximum(1e-6, h0*1e-3), (0.01/np.maximum(d, tiny))**(1/order))
+    
+    return direction*np.minimum(100*h0, h1)
 
 
 def adaptive_step(solver, F, P0, h0, err):
@@ -142,6 +629,246 @@ def Runge_Kutta4(F, P0, h):
     return (x0+h, Y1)
 
 
+def Dormand_Prince45(F, P0, h, K1=None):
+    '''
+        Solving next point with Dormand-Prince 5(4) pair, i.e. a 5 order solution and the
+        error estimated by the embedded 4 order solution.
+
+        Arguments:
+            F : function object return numpy.ndarry values of ODEs (f1, f2, ..., fn)
+            P0: (x0, Y0) where Y0=(y10, y20, ..., yn0) is numpy.ndarry
+            h : step size
+            K1: F(x0, Y0) if known, e.g. the last stage of previous step
+
+        return:
+            next point (x1, Y1), error estimate E, and all stages [K1, ..., K7] where 
+            K7=F(x1, Y1)
+    '''
+    x0, Y0 = P0
+    K = [F(x0, Y0) if K1 is None else K1]
+    for c, A in zip(DP_C[1:], DP_A[1:]):
+        Y1 = Y0 + h*sum(a*k for a, k in zip(A, K) if a)
+        K.append(F(x0+c*h, Y1))
+    E = h*sum(e*k for e, k in zip(DP_E, K) if e)
+
+    return (x0+h, Y1), E, K
+
+def Dormand_Prince45_dense(K):
+    '''
+        Coefficients of the 4 order interpolant of a Dormand-Prince 5(4) step, see 
+        interpolate().
+
+        Arguments:
+            K: all stages of the step [K1, ..., K7]
+
+        return:
+            coefficients Q=[Q1, Q2, Q3, Q4] stacked along the first axis
+    '''
+    return np.tensordot(np.transpose(DP_P), np.stack(K), axes=1)
+
+def Dormand_Prince45_stiffness(K, h):
+    '''
+        Estimate h*|lambda| of a Dormand-Prince 5(4) step from the last two stages, which 
+        are evaluated at the same x:
+
+            h*|lambda| ~ |h| * |K7-K6| / |Y1-Y6|
+
+        where Y6 is the argument of K6. Stiff if it exceeds about 3.3, the boundary of
+        stability domain.
+
+        Arguments:
+            K: all stages of the step [K1, ..., K7]
+            h: step size
+    '''
+    dY = h*sum((a7-a6)*k for a7, a6, k in zip(DP_A[6], DP_A[5]+[0], K))
+    dK = K[6]-K[5]
+    norm = np.sqrt(np.sum(dY**2))
+    return abs(h)*np.sqrt(np.sum(dK**2))/norm if norm>0 else 0.0
+
+Dormand_Prince45.embedded = True
+Dormand_Prince45.order = 5
+Dormand_Prince45.dense = Dormand_Prince45_dense
+Dormand_Prince45.stiffness = Dormand_Prince45_stiffness
+Dormand_Prince45.stability = 3.25
+
+
+class Jacobian:
+    '''
+        Jacobian of F(x, Y) with respect to Y, and the derivative with respect to x, which 
+        are differentiated by autograd if F is written with autograd.numpy, otherwise 
+        approximated by finite differences.
+
+        Arguments:
+            F: derivative function F(x, Y)
+    '''
+
+    def __init__(self, F):
+        self.F = F
+        try:
+            from autograd import jacobian
+            self._jac_Y, self._jac_x = jacobian(F, 1), jacobian(F, 0)
+        except ImportError:
+            self._jac_Y = self._jac_x = None
+
+
+    def __call__(self, x, Y, F0):
+        '''
+            Arguments:
+                x, Y: point to evaluate
+                F0  : F(x, Y)
+
+            Return:
+                J=dF/dY in shape (n, n), where n is the size of Y, i.e. Y is flattened 
+                if it's not a vector
+        '''
+        n = np.size(Y)
+        if self._jac_Y is not None:
+            J = self._autograd(self._jac_Y, x, Y, (n, n))
+            if J is None: 
+                self._jac_Y = self._jac_x = None # not differentiable by autograd, e.g. plain numpy
+            elif np.all(np.isfinite(J)): 
+                return J
+
+        shape, y, f0 = np.shape(Y), np.reshape(Y, -1), np.reshape(F0, -1)
+        J = np.empty((n, n))
+        for j in range(n):
+            dy = np.sqrt(np.finfo(float).eps) * max(abs(y[j]), 1.0)
+            y1 = y.copy()
+            y1[j] += dy
+            J[:, j] = (np.reshape(self.F(x, y1.reshape(shape)), -1) - f0) / dy
+        return J
+
+
+    def time_derivative(self, x, Y, F0):
+        '''
+            Return T=dF/dx in shape (n,), see __call__().
+        '''
+        n = np.size(Y)
+        T = self._autograd(self._jac_x, x, Y, (n,), check=False)
+        if T is not None and np.all(np.isfinite(T)): return T
+
+        dx = np.sqrt(np.finfo(float).eps) * max(abs(x), 1.0)
+        return (np.reshape(self.F(x+dx, Y), -1) - np.reshape(F0, -1)) / dx
+
+
+    @staticmethod
+    def _autograd(jac, x, Y, shape, check=True):
+        '''Derivatives by autograd, or None if F can't be differentiated by it.'''
+        if jac is None: return None
+        import warnings
+        try:
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter('always')
+                D = np.reshape(jac(float(x), Y), shape).astype(float)
+        except Exception:
+            return None
+
+        # autograd warns that output is independent of input if it's not traced, e.g. Y is 
+        # converted by plain numpy; other warnings, e.g. overflow, are passed on
+        untraced = False
+        for w in caught:
+            if 'independent of input' in str(w.message):
+                untraced = True
+            else:
+                warnings.warn(w.message, w.category)
+        return None if check and untraced else D
+
+
+class Rosenbrock23:
+    '''
+        Implicit Rosenbrock 2(3) method of Shampine & Reichelt (1997), i.e. ``ode23s`` of 
+        MATLAB, for stiff ODEs. With W = I - h*d*J, d = 1/(2+sqrt(2)):
+
+            F0 = F(x0, Y0)
+            k1 = W^-1 (F0 + h*d*T)
+            F1 = F(x0+h/2, Y0+h/2*k1)
+            k2 = W^-1 (F1-k1) + k1
+            Y1 = Y0 + h*k2
+            F2 = F(x0+h, Y1)
+            k3 = W^-1 (F2 - (6+sqrt(2))*(k2-F1) - 2*(k1-F0) + h*d*T)
+            E  = h/6 * (k1 - 2*k2 + k3)
+
+        where J=dF/dY and T=dF/dx. It's a W-method, i.e. order 2 with any approximate J, 
+        so the Jacobian is reused across steps, even if step size changes, and evaluated 
+        again only when a step with a Jacobian of another point is rejected, or the Jacobian 
+        is ``max_jacobian_age`` steps old, since the error estimate of order 3 does need an 
+        accurate one. T, which is cheap, is evaluated at each point. W is factorized again
+        only when step size or J changes. Since F2 is F0 of next step, each step costs two 
+        evaluations of F besides T.
+
+        It's stateful, so create one instance per solving, or pass the class to ode().
+    '''
+    embedded = True
+    implicit = True
+    order = 3
+    d = 1/(2+np.sqrt(2))
+    max_jacobian_age = 10
+
+    def __init__(self):
+        self.jacobian = None
+        self.J, self.T = None, None
+        self.x_J = None  # where Jacobian is evaluated
+        self.age = 0     # steps since Jacobian is evaluated
+        self.x_last = None # start of last step
+        self.W, self.h_W = None, None  # factorized W and the step size
+
+
+    def __call__(self, F, P0, h, K1=None):
+        '''
+            Solving next point, see Dormand_Prince45().
+
+            return:
+                next point (x1, Y1), error estimate E, and [k1, k2, F2] where F2=F(x1, Y1)
+        '''
+        x0, Y0 = P0
+        F0 = F(x0, Y0) if K1 is None else K1
+
+        if self.jacobian is None or self.jacobian.F is not F:
+            self.jacobian, self.J = Jacobian(F), None
+        if x0!=self.x_last or self.T is None:
+            self.T = self.jacobian.time_derivative(x0, Y0, F0)
+            self.age += 1
+
+        # Jacobian of current point if a step from here is rejected with an old one, or
+        # it's too old
+        rejected = x0==self.x_last and x0!=self.x_J
+        if self.J is None or rejected or self.age>self.max_jacobian_age:
+            self.J, self.x_J, self.age = self.jacobian(x0, Y0, F0), x0, 0
+            self.W = None
+        self.x_last = x0
+
+        # W is factorized again only if step size or Jacobian changes
+        if self.W is None or h!=self.h_W:
+            W = np.eye(len(self.J)) - h*self.d*self.J
+            self.W = lu_factor(W) if lu_factor else np.linalg.inv(W)
+            self.h_W = h
+        shape = np.shape(Y0)
+        solve = lambda b: np.reshape(lu_solve(self.W, np.reshape(b, -1)) if lu_solve else \
+                                     self.W @ np.reshape(b, -1), shape)
+
+        hdT = np.reshape(h*self.d*self.T, shape)
+        k1 = solve(F0 + hdT)
+        F1 = F(x0+h/2, Y0+h/2*k1)
+        k2 = solve(F1-k1) + k1
+        Y1 = Y0 + h*k2
+        F2 = F(x0+h, Y1)
+        k3 = solve(F2 - (6+np.sqrt(2))*(k2-F1) - 2*(k1-F0) + hdT)
+        E = h/6*(k1 - 2*k2 + k3)
+
+        return (x0+h, Y1), E, [k1, k2, F2]
+
+
+    @classmethod
+    def dense(cls, K):
+        '''
+            Coefficients of the interpolant, see interpolate():
+
+                Y(x) = Y0 + h*(theta*(1-theta)/(1-2d)*k1 + theta*(theta-2d)/(1-2d)*k2)
+        '''
+        k1, k2 = K[0], K[1]
+        return np.stack([(k1-2*cls.d*k2)/(1-2*cls.d), (k2-k1)/(1-2*cls.d)])
+
+
 if __name__ == '__main__':
     
     import matplotlib.pyplot as plt
@@ -154,9 +881,7 @@ if __name__ == '__main__':
     F = lambda x: np.sin(x**2) * np.exp(x)
     f = lambda x,y: 2*x*np.cos(x**2)*np.exp(x) + y
 
-    res = ode(f, span, F(span[0]), err=1e-4)
-    X,Y = zip(*res)
-    X,Y = np.array(X), np.array(Y)
+    X,Y = ode(f, span, F(span[0]), err=1e-4)
 
     plt.figure(tight_layout=True)
     plt.subplot(121)
@@ -172,14 +897,39 @@ if __name__ == '__main__':
         y1, y2 = Y
         return np.array([-np.sin(x), np.cos(x)])
 
-    res = ode(F, span, np.array([0,0]), err=1e-6)    
-    res = [x[1] for x in res]
-    X,Y = zip(*res)
-    X,Y = np.array(X), np.array(Y)
+    _,XY = ode(F, span, np.array([0,0]), err=1e-6)
+    X,Y = XY[:,0], XY[:,1]
 
     plt.subplot(122)
     plt.plot(X, Y, 'o')
     plt.axis('equal')
+
+
+    # -------------------------------
+    # test case 3: batch of ODEs
+    # -------------------------------
+    # pendulum y''=-sin(y) from initial angles in [-3, 3]
+    span = [0, 10]
+    F = lambda x, Y: np.stack([Y[:,1], -np.sin(Y[:,0])], axis=1)
+    Y0 = np.stack([np.linspace(-3, 3, 1000), np.zeros(1000)], axis=1)
+
+    X, Y = ode(F, span, Y0, err=1e-6, batch=True, shared_step=False)
+
+    plt.figure(tight_layout=True)
+    plt.plot(Y[:,::50,0], Y[:,::50,1])
+
+
+    # -------------------------------
+    # test case 4: stiff ODEs
+    # -------------------------------
+    # Van der Pol oscillator with mu=1000
+    span = [0, 3000]
+    F = lambda x, Y: np.array([Y[1], 1000*(1-Y[0]**2)*Y[1]-Y[0]])
+
+    X, Y = ode(F, span, np.array([2.0, 0.0]), err=1e-6, rtol=1e-4, solver=Rosenbrock23)
+
+    plt.figure(tight_layout=True)
+    plt.plot(X, Y[:,0], '.-')
     plt.show()
 
     
@@ -1,6 +1,6 @@
 import autograd.numpy as np
 from autograd import grad
-from ode import ode
+from ode import ode, Dormand_Prince45
 from scipy.integrate import odeint
 
 class BicycleTrack(object):
@@ -60,15 +60,12 @@ class BicycleTrack(object):
         self.L = np.sum((P0-Q0)**2)**0.5
 
         # solving
-        res = ode(self.governing_equation, span, P0, err=err)
+        self.t, XY = ode(self.governing_equation, span, P0, solver=Dormand_Prince45, err=err)
 
         # solved back track
-        XY = [P[1] for P in res]
-        X, Y = zip(*XY)
-        self.X, self.Y = np.array(X), np.array(Y)
+        self.X, self.Y = XY[:,0], XY[:,1]
 
         # front wheel track
-        self.t = np.array([P[0] for P in res])
         self.FX, self.FY = self.front_track_x(self.t), self.front_track_y(self.t)
 
 